@@ -1,9 +1,22 @@
 import streamlit as st
-import pandas as pd
-import os
-import re
+import time
+from contextlib import closing, contextmanager
 import streamlit_authenticator as stauth
-from openai import OpenAI
+
+from market.analysis import (
+    GPT_MODEL, TEMPERATURE, brand_market_analysis, condition_analysis, history_analysis, overall_analysis,
+)
+from market.charts import CHART_MAX_POINTS, trend_chart
+from market.dedup import VIEWS
+from market.ingest import get_frame_cache, load_many, load_uploaded
+from market.llm import get_llm_service
+from market.llm_cache import get_response_cache
+from market.matcher import get_index
+from market.planner import BRAND_MARKET, CONDITION, HISTORY_LINE, OVERALL, detect_mode, plan_question
+from market.prompting import count_tokens
+from market.remote import DEFAULT_REVALIDATE_SECONDS, load_remote
+from market.store import get_snapshot_store
+from market.tracing import begin_trace, finish_trace, get_trace_log, span
 
 # ✅ ✅ 必须放在任何 Streamlit 命令之前！
 hide_github_style = """
@@ -58,7 +71,114 @@ st.sidebar.success(f"✅ Logged in as: {name} ({username})")
 authenticator.logout("Logout", "sidebar")
 
 # 初始化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# ✅ 进程级共享的 OpenAI 客户端：连接池复用 + 限流 + 429 退避重试，所有会话共用
+llm_service = get_llm_service()
+response_cache = get_response_cache()
+
+def remember(render, *args, **kwargs):
+    # 🧷 记录到本次分析结果中，之后的 rerun 原样重放（不重新计算、不调用 API）
+    result = st.session_state.get("last_result")
+    if result is not None:
+        result["items"].append((render, args, kwargs))
+
+
+def shown(render, *args, **kwargs):
+    remember(render, *args, **kwargs)
+    return render(*args, **kwargs)
+
+
+def ask_gpt(analysis):
+    placeholder = st.empty()
+
+    # 💾 相同模式 + 相同筛选条件 + 相同数据 → 直接返回缓存的回答（跨用户、跨重启，与 batch 预热共用）
+    with span("llm_cache") as s:
+        cache_key = analysis.response_key()
+        answer = response_cache.get(cache_key)
+        s.attrs["hit"] = answer is not None
+    if answer is not None:
+        shown(st.caption, "⚡ Answer served from cache")
+        placeholder.markdown(answer)
+        remember(st.markdown, answer)
+        return answer
+
+    # 🌊 流式输出：边生成边显示。用户发起新查询时 Streamlit 会在下一次
+    # placeholder 更新处中断本次运行，closing() 随即关闭 HTTP 流
+    messages = analysis.messages()
+    parts = []
+    last_render = 0.0
+    prompt_tokens = count_tokens(analysis.prompt)
+    with span("llm", model=GPT_MODEL) as s:
+        s.prompt_tokens = prompt_tokens
+        deltas = llm_service.stream(messages, GPT_MODEL, temperature=TEMPERATURE, max_tokens=analysis.max_tokens,
+                                    estimated_tokens=prompt_tokens)
+        with closing(deltas):
+            for delta in deltas:
+                parts.append(delta)
+                if time.monotonic() - last_render > 0.05:
+                    placeholder.markdown("".join(parts) + "▌")
+                    last_render = time.monotonic()
+        answer = "".join(parts)
+        s.completion_tokens = count_tokens(answer)
+
+    placeholder.markdown(answer)
+    remember(st.markdown, answer)
+    response_cache.put(cache_key, answer, mode=analysis.mode)
+    return answer
+
+
+def show_rankings(analysis):
+    # 🏷️ 进程内估值：按车型回归（年份 + 里程）→ 每条房源的 DealScore / 百分位 / 异常价格标记，无需调用 GPT
+    st.markdown("### 🏷️ Best Value Listings")
+    deals = analysis.tables.get("deals")
+    if deals is None or deals.empty:
+        st.warning("Not enough listings per model to rank deals for this selection.")
+        return
+    st.caption("DealScore = % below the model's expected price for its year and mileage; Percentile is within the model.")
+    st.dataframe(deals, hide_index=True)
+    with st.expander("📉 Depreciation by model"):
+        st.dataframe(analysis.tables["curves"], hide_index=True)
+    outliers = analysis.tables["outliers"]
+    if not outliers.empty:
+        with st.expander(f"⚠️ {len(outliers)} implausible prices excluded"):
+            st.dataframe(outliers, hide_index=True)
+
+
+if username == "admin":
+    cache_stats = response_cache.stats()
+    st.sidebar.caption(f"💾 GPT cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+    dataset_stats = get_frame_cache().stats()
+    st.sidebar.caption(f"🗃️ Datasets: {dataset_stats['entries']} loaded ({dataset_stats['bytes'] / 2 ** 20:.1f} MB), "
+                       f"{dataset_stats['pinned']} in use by {dataset_stats['leases']} session leases")
+
+# ⏱️ 分阶段追踪：耗时 / 行数 / token / 内存变化，写入 JSONL 日志，admin 侧栏可见
+trace_log = get_trace_log()
+run_trace = begin_trace(user=username)
+trace_panel = st.sidebar.empty() if username == "admin" else None
+
+
+def show_trace(trace):
+    if trace_panel is None or trace is None:
+        return
+    with trace_panel.container():
+        with st.expander("⏱️ Stage timings", expanded=True):
+            st.caption(f"Last analysis: {trace.attrs.get('mode') or '-'} in {trace.seconds:.2f}s")
+            st.dataframe(trace.frame(), hide_index=True)
+            st.caption("p50 / p95 seconds over recent analyses")
+            st.dataframe(trace_log.stage_percentiles(kind="analysis"), hide_index=True)
+
+
+@contextmanager
+def traced_analysis(question):
+    # st.stop() 会抛出异常中断脚本，finally 保证本次追踪仍被记录
+    try:
+        yield run_trace
+    finally:
+        finish_trace(run_trace, log=trace_log, kind="analysis", question=question)
+        show_trace(run_trace)
+
+
+show_trace(trace_log.last(user=username, kind="analysis"))
+
 st.title("🚗 Dubai Used Car Price Assistant")
 
 # 📂 显示当前数据文件名
@@ -72,449 +192,287 @@ with st.expander("📂 Show Data File Info"):
 data_source = st.radio("Select data source", ["📂 Upload CSV", "🌐 Load from GitHub"])
 df = None
 
+
+def remembered_source(signature, max_age=None):
+    # 🧷 同一数据源（同一批上传文件 / 同一 URL）在 rerun 之间直接复用，不再读取、哈希、解析
+    source = st.session_state.get("loaded_source")
+    if source is None or source["signature"] != signature:
+        return None
+    if max_age is not None and time.time() - source["loaded_at"] > max_age:
+        return None
+    return source
+
+
+def remember_source(signature, frame, filename, leases, notes):
+    # 🔒 本会话持有数据集租约：同一份数据全进程只解析一份，会话间共享同一 DataFrame（只读）；
+    #    会话仍在使用的数据不会被逐出，换文件或会话结束后租约释放
+    st.session_state["loaded_source"] = {
+        "signature": signature, "df": frame, "filename": filename,
+        "leases": leases, "notes": notes, "loaded_at": time.time(),
+    }
+    if filename:
+        st.session_state["current_filename"] = filename
+
+
 if data_source == "📂 Upload CSV":
     uploaded_files = st.file_uploader("Upload one or more CSVs", type=["csv"], accept_multiple_files=True)
     # ✅ 保存到 session_state，以便 history line 模式能识别
     if uploaded_files:
         st.session_state["uploaded_files"] = uploaded_files
 
-
-if uploaded_files:
-    dated_dfs = []
-    for file in uploaded_files:
-        try:
-            temp_df = pd.read_csv(file)
-            if "Date" in temp_df.columns:
-                temp_df["Date"] = pd.to_datetime(temp_df["Date"])
-                dated_dfs.append(temp_df)
-            if df is None:
-                df = temp_df  # 用第一个有效文件初始化显示
-                st.session_state["current_filename"] = file.name
-        except Exception as e:
-            st.warning(f"Failed to load {file.name}: {e}")
+    signature = ("upload",) + tuple(getattr(f, "file_id", f.name) for f in uploaded_files or [])
+    source = remembered_source(signature)
+    if source is None:
+        snapshot_store = get_snapshot_store()
+        # ✅ 按文件内容哈希缓存解析结果，rerun / 多用户之间共享，不再重复 read_csv
+        # ⚡ 多文件并行解析（线程池 + pyarrow 多线程 CSV 引擎），逐个文件显示进度，单个失败不影响其余
+        ingest_bar = st.progress(0.0) if uploaded_files and len(uploaded_files) > 1 else None
+
+        def show_ingest(outcome, done, total):
+            if ingest_bar is not None:
+                ingest_bar.progress(done / total, text=f"Parsed {done}/{total}: {outcome.name}")
+
+        frame, filename, dataset_leases, notes = None, None, [], []
+        for outcome in load_many(uploaded_files or [], progress=show_ingest):
+            if outcome.error is not None:
+                notes.append(f"Failed to load {outcome.name}: {outcome.error}")
+                continue
+            loaded = outcome.loaded
+            dataset_leases.append(loaded.lease)
+            try:
+                # 🗄️ 带日期的市场快照追加进本地快照库（同一内容只写一次）
+                if loaded.has_date and not loaded.is_showroom and not snapshot_store.has_source(loaded.digest):
+                    snapshot_store.append(loaded.frame, loaded.digest)
+            except Exception as e:
+                notes.append(f"Failed to store {outcome.name}: {e}")
+            if frame is None:
+                frame, filename = loaded.frame, outcome.name  # 用第一个有效文件初始化显示
+        if ingest_bar is not None:
+            ingest_bar.empty()
+        remember_source(signature, frame, filename, dataset_leases, notes)
+        source = st.session_state["loaded_source"]
+
+    for note in source["notes"]:
+        st.warning(note)
+    df = source["df"]
 
 elif data_source == "🌐 Load from GitHub":
     github_url = st.text_input("Paste raw GitHub CSV URL")
     if github_url:
+        # 🌐 磁盘缓存 + ETag/If-Modified-Since 重新验证：rerun 不再重复下载；大文件分块下载并显示进度
+        # 🧷 重新验证间隔内直接复用本会话已加载的数据
+        signature = ("github", github_url)
+        source = remembered_source(signature, max_age=DEFAULT_REVALIDATE_SECONDS)
+        download_bar = None
+
+        def show_download(done, total):
+            global download_bar
+            if download_bar is None:
+                download_bar = st.progress(0.0)
+            fraction = min(1.0, done / total) if total else 0.0
+            size = f"{done / 2 ** 20:.1f} / {total / 2 ** 20:.1f} MB" if total else f"{done / 2 ** 20:.1f} MB"
+            download_bar.progress(fraction, text=f"Downloading {size}")
+
         try:
-            df = pd.read_csv(github_url)
-            filename = github_url.split("/")[-1]
-            st.session_state["current_filename"] = filename
-            st.success(f"✅ Loaded: {filename} ({df.shape[0]} rows)")
+            if source is None:
+                with span("load_remote", url=github_url) as s:
+                    loaded, remote_meta = load_remote(github_url, progress=show_download)
+                    s.rows_out = len(loaded.frame)
+                    s.attrs["status"] = remote_meta["status"]
+                if download_bar is not None:
+                    download_bar.empty()
+                remember_source(signature, loaded.frame, loaded.name, [loaded.lease], [])
+                source = st.session_state["loaded_source"]
+            df = source["df"]
+            st.success(f"✅ Loaded: {source['filename']} ({df.shape[0]} rows)")
         except Exception as e:
             st.error(f"❌ Failed to load from GitHub: {e}")
 
-# 🧠 用户提问处理逻辑
-if df is not None:
+
+@st.fragment
+def preview_panel(frame):
+    # 🧩 独立 fragment：调整预览行数只重跑这一块
     with st.expander("🔍 Preview Data"):
-        st.dataframe(df.head())
+        rows = st.slider("Rows", min_value=5, max_value=100, value=5, step=5, key="preview_rows")
+        st.dataframe(frame.head(rows))
+
+
+@st.fragment
+def result_tables(result):
+    # 🧩 独立 fragment：展开分析中间表只重跑这一块
+    tables = result.get("tables") or {}
+    if tables and st.toggle("🧾 Show analysis tables", key="show_result_tables"):
+        for table_name, table in tables.items():
+            st.markdown(f"**{table_name}**")
+            st.dataframe(table, hide_index=True)
 
-    user_question = st.text_input("Ask a question about the car market:", placeholder="e.g., condition: under 120000km, BMW or Lexus, below 90k AED")
 
-    if user_question and st.button("🔎 Analyze"):
-        with st.spinner("Analyzing data with GPT-4o..."):
+def result_panel(result):
+    # 🧷 重放上一次分析（说明、图表、GPT 回答），不重新计算也不调用 API
+    st.caption(f"🧷 Last analysis: “{result['question']}”")
+    for render, args, kwargs in result["items"]:
+        render(*args, **kwargs)
+    result_tables(result)
+
+
+# 🧠 用户提问处理逻辑
+if df is not None:
+    preview_panel(df)
+
+    # 📝 表单：输入问题、切换选项都不会触发 rerun，点击 Analyze 才提交
+    with st.form("ask"):
+        user_question = st.text_input("Ask a question about the car market:", placeholder="e.g., condition: under 120000km, BMW or Lexus, below 90k AED")
+        # 🧬 history line：同一条广告会出现在连续多天的快照里，可选按唯一房源（去重）或按每日快照查看
+        history_view = st.radio("History view (history line questions)", VIEWS, horizontal=True,
+                                help="Unique listings: each ad counted once, on the day it was first seen. "
+                                     "Daily snapshots: every ad in every daily file it appeared in.")
+        submitted = st.form_submit_button("🔎 Analyze")
+
+    # 🧷 同一问题 + 同一数据 + 同一快照库 → 直接重放上一次结果
+    last_result = st.session_state.get("last_result")
+    result_key = (user_question, history_view, st.session_state["loaded_source"]["signature"],
+                  len(get_snapshot_store()) if detect_mode(user_question or "") == HISTORY_LINE else None)
+    repeated = last_result is not None and last_result.get("complete") and last_result["key"] == result_key
+    if submitted and user_question and repeated:
+        st.caption("♻️ Same question on the same data: showing the earlier result")
+    if submitted and user_question and not repeated:
+        st.session_state["last_result"] = last_result = {"key": result_key, "question": user_question, "items": []}
+        with st.spinner("Analyzing data with GPT-4o..."), traced_analysis(user_question):
 
             required_cols = ['Brand', 'Model', 'Price', 'Year', 'Kilometers']
             if not all(col in df.columns for col in required_cols):
-                st.error(f"Missing required columns: {required_cols}")
+                shown(st.error, f"Missing required columns: {required_cols}")
             else:
-                data = df[required_cols].dropna().copy()
-                data['Price'] = data['Price'].astype(str).str.replace(",", "").str.extract('(\d+)').astype(float)
-                data['Kilometers'] = data['Kilometers'].astype(str).str.replace(",", "").str.extract('(\d+)').astype(float)
+                # ✅ df 已在加载时标准化（Price / Kilometers 为数值）
+                # 🔤 品牌/车型索引按数据集缓存，rerun 之间复用
+                brand_index = get_index(df)
+                # 🧭 问题只解析一次：模式 + 品牌/车型 + 年份 + 价格区间 + 里程上限（按问题缓存）
+                plan = plan_question(user_question, brand_index)
+                run_trace.attrs["mode"] = plan.mode
+                analysis = None
 
 # ================================================================================================================================================ #
 
                 # 🚨 Condition 模式：自然语言筛选请求
-                if "condition" in user_question.lower():
-                    price_match = re.search(r'(?:under|below|less than)?\s*\$?(\d{4,6})\s*(?:to|-|and)?\s*\$?(\d{4,6})?', user_question)
-
-                    km_match = re.search(r'(?:under|below|less than)?\s*(\d{2,3},?\d{3})\s*(?:km|kilometers)', user_question, re.IGNORECASE)
-
-
-                    all_brands = data["Brand"].dropna().unique().tolist()
-                    brand_selected = [b for b in all_brands if re.search(rf"\\b{re.escape(b)}\\b", user_question, re.IGNORECASE)]
-
-                    price_min, price_max, km_limit = None, None, None
-                    if price_match:
-                        price_min = float(price_match.group(1).replace(',', ''))
-                        if price_match.group(2):
-                            price_max = float(price_match.group(2).replace(',', ''))
-                    if km_match:
-                        km_limit = float(km_match.group(1).replace(',', ''))
-
-                    filtered_data = data.copy()
-                    if price_min:
-                        filtered_data = filtered_data[filtered_data["Price"] >= price_min]
-                    if price_max:
-                        filtered_data = filtered_data[filtered_data["Price"] <= price_max]
-                    if km_limit:
-                        filtered_data = filtered_data[filtered_data["Kilometers"] <= km_limit]
-                    if brand_selected:
-                        filtered_data = filtered_data[filtered_data["Brand"].isin(brand_selected)]
-
-                    st.info(f"🔍 Detected conditions → Price: {price_min}-{price_max}, KM: {km_limit}, Brands: {', '.join(brand_selected) if brand_selected else 'Not specified'}")
-
-                    prompt = f"""
-You are a car market assistant in Dubai.
-
-A user asked: "{user_question}"
-
-Step 1: Identify cars that match the filters below.
-
-Step 2: Must Create Markdown TABLES with frame and highlight differences in price, age, mileage.Summarize the matched cars by model, including their average price, year, and mileage.
-
-Step 3: Summarize the matched cars by model, including their average price, year, and mileage.
-
-Step 4: Write clear and helpful suggestions based on your analysis:
-
-- For BUYERS: Which models offer the best value for money, combining price, mileage and year?
-- For SELLERS: What should sellers emphasize in these listings? Which models are appealing and why?
-
-⚠️ Do NOT skip these suggestions. The user is a business decision-maker and needs your recommendations.
+                if plan.mode == CONDITION:
+                    # 🔤 品牌/车型词典：一次遍历识别问题中提到的所有品牌和车型（已在 plan 中）
+                    brand_selected = list(plan.mentions.brands)
+                    model_selected = [m for _, m in plan.mentions.models]
+
+                    shown(
+                        st.info,
+                        f"🔍 Detected conditions → Price: {plan.price_min}-{plan.price_max}, KM: {plan.km_max}, "
+                        f"Brands: {', '.join(brand_selected) if brand_selected else 'Not specified'}, "
+                        f"Models: {', '.join(model_selected) if model_selected else 'Not specified'}"
+                    )
 
-Here is the dataset:
+                    # ✅ 先按品牌/车型行索引取子集，再用布尔掩码做数值过滤；
+                    # 🧮 按 token 预算压缩数据：全量行 → 分组汇总 → 分层抽样 → 分位数表
+                    analysis = condition_analysis(df, plan, user_question, brand_index)
+                    shown(st.caption, f"🧮 Prompt data: {analysis.prompt_table.describe()}")
 
-{filtered_data.to_csv(index=False)}
-"""
+                    if plan.rankings_only:
+                        shown(show_rankings, analysis)
+                    else:
+                        shown(st.markdown, "### 📊 GPT-4 Analysis Result")
+                        ask_gpt(analysis)
                     
 # ================================================================================================================================================ #
 
                  # 📈 新模式：历史趋势图分析
-                elif "history line" in user_question.lower():
-                    # 🧠 新版引号匹配
-                    brand_match = re.search(r'brand-[\'"]?([\w\s\-]+)[\'"]?', user_question, re.IGNORECASE)
-                    model_match = re.search(r'model-[\'"]?([\w\s\-]+)[\'"]?', user_question, re.IGNORECASE)
-
-                    if not brand_match or not model_match:
-                        st.error("❌ Format must be like: 'history line brand-\"Tesla\" model-\"Model Y\"'")
+                elif plan.mode == HISTORY_LINE:
+                    # 🧠 新版引号匹配（brand-"..." model-"..."，已在 plan 中解析）
+                    if not plan.brand or not plan.model:
+                        shown(st.error, "❌ Format must be like: 'history line brand-\"Tesla\" model-\"Model Y\"'")
                         st.stop()
 
-                    brand = brand_match.group(1).strip()
-                    model = model_match.group(1).strip()
-                    st.info(f"📌 Searching historical trend for **{brand} {model}**")
+                    shown(st.info, f"📌 Searching historical trend for **{plan.brand} {plan.model}**")
 
-                    if "uploaded_files" not in st.session_state or not st.session_state["uploaded_files"]:
-                        st.error("❌ No history files uploaded. Please upload multiple dated CSVs.")
+                    # 🗄️ 市场历史来自本地快照库（按 Date 分区），不再依赖本次会话重新上传
+                    snapshot_store = get_snapshot_store()
+                    if not len(snapshot_store):
+                        shown(st.error, "❌ No history snapshots stored yet. Please upload multiple dated CSVs.")
                         st.stop()
 
-                    all_history_df = []
+                    shown(st.subheader, "📈 Price Distribution + Median Trend")
 
-                    for f in st.session_state["uploaded_files"]:
+                    # 🚩 showroom 文件（无 Date）仍从本次上传中读取
+                    showroom_frames = []
+                    for f in st.session_state.get("uploaded_files") or []:
                         try:
-                            f.seek(0)
-                            df_temp = pd.read_csv(f, encoding="utf-8-sig")
-
-                            is_showroom = "showroom" in f.name.lower()
-
-                            # ✅ 只有市场数据强制检查 Date 字段
-                            if not is_showroom and "Date" not in df_temp.columns:
-                                st.warning(f"⚠️ Skipped file {f.name}: No 'Date' column.")
-                                continue
-
-                            # ✅ 仅市场数据转换 Date 列
-                            if not is_showroom:
-                                df_temp["Date"] = pd.to_datetime(df_temp["Date"], errors="coerce")
-
-                            
-                            df_temp["Brand"] = df_temp["Brand"].astype(str)
-                            df_temp["Model"] = df_temp["Model"].astype(str)
-                            df_temp["Price"] = df_temp["Price"].astype(str).str.replace(",", "").str.extract(r"(\d+)").astype(float)
-                            df_temp["Kilometers"] = df_temp["Kilometers"].astype(str).str.replace(",", "").str.extract(r"(\d+)").astype(float)
-
-                            # 🔍 模糊筛选
-                            df_filtered = df_temp[
-                                df_temp["Brand"].str.lower().str.contains(brand.lower(), na=False) &
-                                df_temp["Model"].str.lower().str.contains(model.lower(), na=False)
-                            ]
-
-                            # ⏬ 年份过滤机制：如果存在 year- 触发词
-                            year_match = re.search(r'year-[\'"]?([\d,\s]+)[\'"]?', user_question, re.IGNORECASE)
-                            if year_match:
-                                year_list = [int(y.strip()) for y in year_match.group(1).split(",") if y.strip().isdigit()]
-                                df_filtered = df_filtered[df_filtered["Year"].isin(year_list)]
-
-                            if df_filtered.empty:
-                                st.warning(f"⚠️ No match in {f.name}, skipped.")
-                                continue
-
-                            all_history_df.append(df_filtered)
-
+                            loaded = load_uploaded(f)
+                            if loaded.is_showroom and not loaded.has_date:
+                                showroom_frames.append(loaded.frame)
                         except Exception as e:
-                            st.warning(f"⚠️ Skipped file {f.name}: {e}")
-
-                    if not all_history_df:
-                        st.error("❌ No valid records found in any file for the given brand/model.")
+                            shown(st.warning, f"⚠️ Skipped file {f.name}: {e}")
+
+                    # 🔍 模糊筛选在 Arrow 层完成（⏬ 含 year- 年份过滤）；✅ 每日中位数直接读预聚合 rollup
+                    # 🧬 跨快照指纹去重（Title/Brand/Model/Year/Km 哈希），记录首次/最后出现日期和调价次数
+                    analysis = history_analysis(snapshot_store, plan, showroom_frames, history_view)
+                    history_df = analysis.rows
+                    if history_df.empty:
+                        shown(st.error, "❌ No valid records found in any snapshot for the given brand/model.")
                         st.stop()
-
-                    history_df = pd.concat(all_history_df)
-                    history_df.sort_values("Date", inplace=True)
-
-                    import altair as alt
-
-                    st.subheader("📈 Price Distribution + Median Trend")
-
-                    # 🚩区分 showroom 文件（无 Date）与市场文件（有 Date）
-                    market_data_list = []
-                    showroom_data_list = []
-
-                    for f in st.session_state["uploaded_files"]:
-                        f.seek(0)
-                        df_temp = pd.read_csv(f, encoding="utf-8-sig")
-                        if "Brand" not in df_temp.columns or "Model" not in df_temp.columns:
-                            continue
-
-                        # 标准化字段
-                        df_temp["Brand"] = df_temp["Brand"].astype(str)
-                        df_temp["Model"] = df_temp["Model"].astype(str)
-                        df_temp["Price"] = df_temp["Price"].astype(str).str.replace(",", "").str.extract(r"(\d+)").astype(float)
-                        df_temp["Kilometers"] = df_temp["Kilometers"].astype(str).str.replace(",", "").str.extract(r"(\d+)").astype(float)
-                        df_temp["Year"] = df_temp["Year"].astype(float)
-
-                        # 品牌&车型筛选
-                        df_filtered = df_temp[
-                            df_temp["Brand"].str.lower().str.contains(brand.lower(), na=False) &
-                            df_temp["Model"].str.lower().str.contains(model.lower(), na=False)
-                        ]
-
-                        # ⏬ 年份筛选（如果指定了）
-                        year_match = re.search(r'year-[\'"]?([\d,\s]+)[\'"]?', user_question, re.IGNORECASE)
-                        if year_match:
-                            year_list = [int(y.strip()) for y in year_match.group(1).split(",") if y.strip().isdigit()]
-                            df_filtered = df_filtered[df_filtered["Year"].isin(year_list)]
-
-                        # 区分 showroom 文件 vs 市场文件
-                        if "date" in df_filtered.columns.str.lower().tolist():
-                            df_filtered["Date"] = pd.to_datetime(df_filtered["Date"], errors="coerce")
-                            market_data_list.append(df_filtered)
-                        elif "showroom" in f.name.lower():
-                            showroom_data_list.append(df_filtered)
-
-                    # 合并
-                    if not market_data_list:
-                        st.warning("❗ No market data found.")
-                        st.stop()
-
-                    history_df = pd.concat(market_data_list)
-                    history_df.sort_values("Date", inplace=True)
-
-                    showroom_df = pd.concat(showroom_data_list) if showroom_data_list else pd.DataFrame(columns=history_df.columns)
-
-                    # ✅ 计算每日中位数
-                    median_df = history_df.groupby("Date").agg({
-                        "Price": "median",
-                        "Kilometers": "mean",
-                        "Year": "mean"
-                    }).reset_index().rename(columns={"Price": "MedianPrice"})
-
-                    # 图层一：蓝色市场数据点
-                    point_chart = alt.Chart(history_df).mark_circle(size=60, color='steelblue').encode(
-                        x=alt.X('Date:T', title='Date'),
-                        y=alt.Y('Price:Q', title='Price (AED)'),
-                        tooltip=[
-                            alt.Tooltip('Date:T'),
-                            alt.Tooltip('Price:Q'),
-                            alt.Tooltip('Kilometers:Q'),
-                            alt.Tooltip('Year:Q')
-                        ]
-                    )
-
-                    # 图层二：红色中位数点+线
-                    median_line = alt.Chart(median_df).mark_line(color='red', strokeWidth=2).encode(
-                        x='Date:T',
-                        y='MedianPrice:Q'
-                    )
-                    median_point = alt.Chart(median_df).mark_point(color='red', size=80, filled=True).encode(
-                        x='Date:T',
-                        y='MedianPrice:Q',
-                        tooltip=[
-                            alt.Tooltip('Date:T'),
-                            alt.Tooltip('MedianPrice:Q'),
-                            alt.Tooltip('Kilometers:Q', title="Avg Mileage"),
-                            alt.Tooltip('Year:Q', title="Avg Year")
-                        ]
-                    )
-
-                    # 图层三：黄色 showroom 横线（跨所有日期范围）
-                    # 图层三：黄色 showroom 横线（跨所有日期范围）
-                    if not showroom_df.empty:
-                        x_min = history_df["Date"].min()
-                        x_max = history_df["Date"].max()
-
-                        # 修正方式：用 transform_calculate 为每条 showroom 数据横跨整个图宽度
-                        showroom_df["x_start"] = x_min
-                        showroom_df["x_end"] = x_max
-
-                        showroom_lines = alt.Chart(showroom_df).mark_rule(
-                            color='gold',
-                            strokeDash=[3, 3]
-                        ).encode(
-                            x='x_start:T',
-                            x2='x_end:T',
-                            y='Price:Q',
-                            tooltip=[
-                                alt.Tooltip('Price:Q', title="Showroom Price"),
-                                alt.Tooltip('Kilometers:Q'),
-                                alt.Tooltip('Year:Q')
-                            ]
-                        )
-
-                        combined_chart = point_chart + median_line + median_point + showroom_lines
-                    else:
-                        combined_chart = point_chart + median_line + median_point
-
-                    
-                    # 📈 显示图表
-                    st.altair_chart(combined_chart.properties(
-                        width=700,
-                        height=400
-                    ).interactive(), use_container_width=True)
-
-
-
-
-                    trend_prompt = f"""
-                You are a professional automotive data analyst in Dubai.
-
-                A user requested a historical analysis with the following filters:
-                Brand: {brand}
-                Model: {model}
-
-                Here is the historical dataset:
-                {history_df.to_csv(index=False)}
-
-                Please:
-                1. Identify whether the price is increasing or decreasing.
-                2. Discuss how mileage trend evolves over time.
-                3. Comment on whether average manufacturing year is getting newer or older.
-                4. Make recommendations for buyers based on these trends.
-                """
-
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[
-                            {"role": "system", "content": "You are a data analyst specialized in car market trends in Dubai."},
-                            {"role": "user", "content": trend_prompt}
-                        ],
-                        temperature=0.3,
-                        max_tokens=3000
-                    )
-
-                    st.markdown("### 📊 Historical Trend GPT Analysis")
-                    st.markdown(response.choices[0].message.content)
-                    st.stop()
+                    listings = analysis.tables["listings"]
+                    shown(st.caption, f"🗄️ {listings['Days'].sum()} snapshot rows across {len(snapshot_store)} stored snapshots → "
+                               f"{len(listings)} unique listings, {(listings['PriceChanges'] > 0).sum()} with price changes "
+                               f"(showing {history_view})")
+
+                    # 📉 点数过多时在服务端降采样（分位数带/密度网格），中位数线与 showroom 线保持精确
+                    with span("chart", rows_in=len(history_df)) as s:
+                        combined_chart, reduction = trend_chart(history_df, analysis.tables["median"], analysis.tables["showroom"])
+                        s.attrs["reduction"] = reduction
+                        if reduction != "points":
+                            shown(st.caption, f"📉 {len(history_df)} listings drawn as {reduction} (raw points above {CHART_MAX_POINTS} are reduced)")
+
+                        # 📈 显示图表
+                        shown(st.altair_chart, combined_chart.properties(
+                            width=700,
+                            height=400
+                        ).interactive(), use_container_width=True)
+
+                    # 🧮 按 token 预算压缩历史数据（按日期分组/抽样）
+                    shown(st.caption, f"🧮 Prompt data: {analysis.prompt_table.describe()}")
+
+                    shown(st.markdown, "### 📊 Historical Trend GPT Analysis")
+                    ask_gpt(analysis)
 
 # ================================================================================================================================================ #
 
                 # 🚗 品牌市场分析模块（新触发逻辑：brand market + brand-"XXX" 格式）
-                elif "brand market" in user_question.lower():
-                    brand_match = re.search(r'brand-[\'"]?([\w\s\-]+)[\'"]?', user_question, re.IGNORECASE)
-
-                    if not brand_match:
-                        st.warning("⚠️ Could not detect brand from your query. Please use format like: brand market brand-\"Toyota\"")
-                        prompt_data = data.sample(min(100, len(data)))
-                        matched_brands = []
+                elif plan.mode == BRAND_MARKET:
+                    analysis = brand_market_analysis(df, plan, user_question, brand_index)
+                    if not plan.brand:
+                        shown(st.warning, "⚠️ Could not detect brand from your query. Please use format like: brand market brand-\"Toyota\"")
                     else:
-                        brand_name = brand_match.group(1).strip()
-                        matched_brands = [brand_name]
-                        prompt_data = data[data["Brand"].str.lower().str.contains(brand_name.lower(), na=False)]
-                        st.info(f"📌 Detected brand: {brand_name}. Analyzing {len(prompt_data)} records.")
-
-                    brand_group = prompt_data.groupby("Brand").agg({
-                        "Price": "mean", "Year": "mean", "Kilometers": "mean"
-                    }).reset_index()
-
-                    model_group = prompt_data.groupby(["Brand", "Model"]).agg({
-                        "Price": "mean",
-                        "Year": "mean",
-                        "Kilometers": "mean",
-                        "Model": "count"
-                    }).rename(columns={"Model": "Count"}).reset_index()
-
-                    model_group.columns = ["Brand", "Model", "Avg Price", "Avg Year", "Avg Km", "Count"]
-
-
-                    prompt = f"""
-You are a professional car market analyst in Dubai.
-
-A user asked: "{user_question}"
-
-Here is the dataset filtered by brand(s): {', '.join(matched_brands) if matched_brands else 'Random Sample'}.
-
-First, a brand-level summary:
-
-{brand_group.to_markdown(index=False)}
-
-Then, model-level details:
-
-{model_group.to_markdown(index=False)}
-
-Please perform the following:
-1. Compare all mentioned brands and their models.
-2. Create Markdown tables and highlight differences in price, age, mileage.
-3. Analyze differences between the models and which stand out.
-4. Provide summary recommendation.
-5. Based on the analysis, provide practical suggestions for buyers (e.g., which models or years offer the best value, which to avoid, etc.)
-                """
-
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[
-                            {"role": "system", "content": "You are a data analyst specialized in car market trends in Dubai."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.3,
-                        max_tokens=5000
-                    )
-
-                    st.markdown("### 📊 GPT-4 Analysis Result")
-                    st.markdown(response.choices[0].message.content)
-
+                        shown(st.info, f"📌 Detected brand: {plan.brand}. Analyzing {len(analysis.rows)} records.")
 
+                    if plan.rankings_only:
+                        shown(show_rankings, analysis)
+                    else:
+                        shown(st.markdown, "### 📊 GPT-4 Analysis Result")
+                        ask_gpt(analysis)
 
 # ================================================================================================================================================ #
 
                 # 🌍 全局市场趋势模式
-                elif any(kw in user_question.lower() for kw in ['overall', 'market', 'all brands', 'general trend', 'whole market', 'total', '总览', '整体', '全部', '所有', '市场', '平均']):
-                    brand_summary = data.groupby("Brand").agg({
-                        "Model": "nunique",
-                        "Price": ["mean", "min", "max"],
-                        "Year": "mean",
-                        "Kilometers": "mean"
-                    }).reset_index()
-                    brand_summary.columns = ['Brand', 'Model Count', 'Avg Price', 'Min Price', 'Max Price', 'Avg Year', 'Avg Km']
-
-                    overall = pd.DataFrame({
-                        'Brand': ['Overall'],
-                        'Model Count': [brand_summary['Model Count'].sum()],
-                        'Avg Price': [data['Price'].mean()],
-                        'Min Price': [data['Price'].min()],
-                        'Max Price': [data['Price'].max()],
-                        'Avg Year': [data['Year'].mean()],
-                        'Avg Km': [data['Kilometers'].mean()]
-                    })
-
-                    brand_summary = pd.concat([brand_summary, overall], ignore_index=True)
-
-                    prompt = f"""
-You are a professional automotive market analyst in Dubai.
-
-The user asked: "{user_question}"
-
-Here is a summary of the entire used car dataset (10,000+ records), generated from real data.
-
-Brand-level statistics including an overall row at the bottom:
-
-{brand_summary.to_markdown(index=False)}
-
-Please:
-1. Identify major market trends across price, mileage, and year.
-2. Highlight which brands are high-end vs affordable.
-3. Comment on how mileage correlates with price or year.
-4. Suggest which segments (brands/models) offer the best value.
-5. Write like you're briefing a business executive team in simple, clear terms.
-6. Based on the analysis, provide practical suggestions for buyers (e.g., which brands or years offer the best value, which to avoid, etc.)
-"""
+                elif plan.mode == OVERALL:
+                    analysis = overall_analysis(df, plan, user_question, brand_index)
+
+                    if plan.rankings_only:
+                        shown(show_rankings, analysis)
+                    else:
+                        shown(st.markdown, "### 📊 GPT-4 Analysis Result")
+                        ask_gpt(analysis)
+
+                # 🧾 中间表随结果一起保存，可在结果区展开查看
+                if analysis is not None:
+                    last_result["tables"] = dict(analysis.tables)
+                    result_tables(last_result)
+                last_result["complete"] = True
 
-                
+    elif last_result is not None:
+        result_panel(last_result)
 
-                
+# ⏱️ 没有点击 Analyze 的运行（如新上传文件的解析）也记录下来
+finish_trace(run_trace, log=trace_log, kind="rerun")
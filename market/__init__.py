@@ -0,0 +1 @@
+"""Data and analysis helpers behind the Dubai car market Streamlit app."""
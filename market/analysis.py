@@ -0,0 +1,340 @@
+"""The four analysis modes, independent of the Streamlit UI.
+
+Each ``*_analysis`` function takes the normalized data and a
+:class:`~market.planner.QueryPlan` and returns an :class:`Analysis`: the
+prompt to send, the data text that identifies the answer in the response
+cache, and the intermediate tables the UI shows.  ``app.py`` renders them;
+the benchmark and batch runners call :func:`run_analysis` directly.
+
+The condition, brand market and overall modes also rank the selected
+listings with :mod:`market.valuation` and add the compact result (model
+depreciation curves and the best deals) to the prompt; a question that
+only asks for a ranking (``plan.rankings_only``) needs no LLM call at all.
+"""
+
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from market.dedup import DAILY, UNIQUE, track_listings, unique_rows, unique_trend
+from market.ingest import content_hash
+from market.llm_cache import make_key
+from market.matcher import get_index
+from market.planner import (
+    BRAND_MARKET, CONDITION, HISTORY_LINE, OVERALL, REQUIRED_COLUMNS, plan_question, select_rows,
+)
+from market.prompting import fit_table
+from market.store import contains_filter
+from market.tracing import span
+from market.valuation import get_valuation
+
+HISTORY_COLUMNS = ["Brand", "Model", "Price", "Year", "Kilometers"]
+
+GPT_MODEL = "gpt-4o"
+TEMPERATURE = 0.3
+SYSTEM_PROMPT = "You are a data analyst specialized in car market trends in Dubai."
+
+
+@dataclass
+class Analysis:
+    mode: str
+    plan: object
+    prompt: str = None  # None when there is nothing to analyze
+    data_text: str = ""
+    max_tokens: int = 5000
+    rows: object = None  # the rows the analysis was computed from
+    prompt_table: object = None
+    tables: dict = field(default_factory=dict)
+
+    def messages(self):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self.prompt},
+        ]
+
+    def response_key(self):
+        """Key of this analysis' answer in the response cache, the same from the app and batch runs.
+
+        The prompt quotes the question, so differently worded questions
+        with the same filters get their own answers.
+        """
+        prompt = "\n".join(m["content"] for m in self.messages())
+        return make_key(self.mode, self.plan.cache_key(), content_hash(self.data_text.encode("utf-8")),
+                        content_hash(prompt.encode("utf-8")),
+                        model=GPT_MODEL, temperature=TEMPERATURE, max_tokens=self.max_tokens)
+
+
+def select_view(frame, positions, columns=REQUIRED_COLUMNS):
+    """``columns`` of ``frame`` at row ``positions``.
+
+    ``frame`` is a shared, registered dataset: when every row is selected
+    the result is a copy-on-write view of it, otherwise only the selected
+    rows of the requested columns are gathered.
+    """
+    view = frame[list(columns)]
+    if len(positions) == len(frame):
+        return view
+    return view.take(positions)
+
+
+def _filter(frame, plan, index=None):
+    with span("filter", rows_in=len(frame)) as s:
+        positions = select_rows(frame, plan, index)
+        rows = select_view(frame, positions)
+        s.rows_out = len(rows)
+    return positions, rows
+
+
+def _valuation(frame, positions, n=10):
+    """Deal ranking and depreciation curves for the selected rows, as prompt text and tables."""
+    valuation = get_valuation(frame)
+    with span("rank", rows_in=len(positions)) as s:
+        deals = valuation.rankings(frame, positions, n=n)
+        curves = valuation.curves_for(frame, positions)
+        outliers = valuation.outliers(frame, positions)
+        s.rows_out = len(deals)
+    if deals.empty:
+        return "", {"deals": deals, "curves": curves, "outliers": outliers}
+    text = f"""
+In-house valuation (per-model regression of log price on age and mileage; DealScore = % below the
+model's expected price; {len(outliers)} implausible prices excluded as outliers):
+
+Depreciation by model:
+{curves.to_csv(index=False)}
+Best value listings:
+{deals.drop(columns="Title", errors="ignore").to_csv(index=False, float_format="%.1f")}"""
+    return text, {"deals": deals, "curves": curves, "outliers": outliers}
+
+
+def _fit(rows, group_by):
+    with span("serialize", rows_in=len(rows)) as s:
+        prompt_table = fit_table(rows, group_by=group_by)
+        s.rows_out = prompt_table.rows_out
+        s.attrs["table_tokens"] = prompt_table.tokens
+        s.attrs["level"] = prompt_table.level
+    return prompt_table
+
+
+def condition_analysis(frame, plan, question, index=None):
+    positions, rows = _filter(frame, plan, index)
+    prompt_table = _fit(rows, ["Brand", "Model"])
+    valuation_text, tables = _valuation(frame, positions)
+
+    prompt = f"""
+You are a car market assistant in Dubai.
+
+A user asked: "{question}"
+
+Step 1: Identify cars that match the filters below.
+
+Step 2: Must Create Markdown TABLES with frame and highlight differences in price, age, mileage.Summarize the matched cars by model, including their average price, year, and mileage.
+
+Step 3: Summarize the matched cars by model, including their average price, year, and mileage.
+
+Step 4: Write clear and helpful suggestions based on your analysis:
+
+- For BUYERS: Which models offer the best value for money, combining price, mileage and year?
+- For SELLERS: What should sellers emphasize in these listings? Which models are appealing and why?
+
+⚠️ Do NOT skip these suggestions. The user is a business decision-maker and needs your recommendations.
+
+Here is the dataset ({prompt_table.level}):
+
+{prompt_table.text}
+{valuation_text}
+"""
+    return Analysis(CONDITION, plan, prompt, prompt_table.text + valuation_text, 5000, rows, prompt_table, tables)
+
+
+def showroom_rows(frames, plan):
+    """Rows of the showroom (undated) frames matching the plan's brand/model/years."""
+    parts = [select_view(f, select_rows(f, plan, required=("Price",)), f.columns) for f in frames]
+    parts = [p for p in parts if not p.empty]
+    return pd.concat(parts) if parts else pd.DataFrame(columns=HISTORY_COLUMNS)
+
+
+def history_analysis(store, plan, showroom_frames=(), view=UNIQUE):
+    """Trend of ``plan.brand``/``plan.model`` across every stored snapshot.
+
+    Listings are read from the snapshot store with the filter pushed down to
+    Arrow and fingerprinted across snapshots.  ``view`` picks what the chart
+    and prompt show: each listing once, at the date it was first seen
+    (:data:`~market.dedup.UNIQUE`), or every snapshot as stored with the
+    daily median from the pre-aggregated rollup (:data:`~market.dedup.DAILY`).
+
+    Only the daily view's trend line comes from the rollup.  The matching
+    listings are still read in both views: the chart points, the listing
+    fingerprints and the prompt rows are per listing, and the unique view's
+    trend is by first-seen date, which the per-day rollup cannot answer.
+    """
+    history_filter = contains_filter(plan.brand, plan.model, list(plan.years) or None)
+    history_df = store.read(columns=HISTORY_COLUMNS + ["Title"], where=history_filter)
+    analysis = Analysis(HISTORY_LINE, plan, max_tokens=3000, rows=history_df)
+    if history_df.empty:
+        return analysis
+
+    tracked = track_listings(history_df)
+    analysis.tables["listings"] = tracked.listings
+    analysis.tables["showroom"] = showroom_rows(showroom_frames, plan)
+    if view == DAILY:
+        history_df = history_df.drop(columns="Title").sort_values("Date", kind="stable")
+        store.ensure_rollup()
+        analysis.tables["median"] = store.rollup.trend(history_filter)
+    else:
+        history_df = unique_rows(tracked.listings)
+        analysis.tables["median"] = unique_trend(tracked.listings)
+    analysis.rows = history_df
+
+    prompt_table = _fit(history_df, ["Date"])
+    analysis.prompt_table = prompt_table
+    analysis.data_text = f"{view}\n{prompt_table.text}"
+    listings_note = (
+        f"The {len(tracked.daily)} snapshot rows are {len(tracked.listings)} distinct listings; "
+        f"{tracked.price_changed} of them changed price while listed."
+    )
+    if view == DAILY:
+        dataset_note = "one row per listing per daily snapshot, so a listing that stayed up appears on several dates"
+    else:
+        dataset_note = ("one row per distinct listing, dated when it was first seen and priced as first listed; "
+                        "LastPrice, LastSeen, Days and PriceChanges follow it until it was last seen")
+    analysis.prompt = f"""
+You are a professional automotive data analyst in Dubai.
+
+A user requested a historical analysis with the following filters:
+Brand: {plan.brand}
+Model: {plan.model}
+
+{listings_note}
+
+Here is the historical dataset ({dataset_note}; {prompt_table.level}):
+{prompt_table.text}
+
+Please:
+1. Identify whether the price is increasing or decreasing.
+2. Discuss how mileage trend evolves over time.
+3. Comment on whether average manufacturing year is getting newer or older.
+4. Make recommendations for buyers based on these trends.
+"""
+    return analysis
+
+
+def brand_market_analysis(frame, plan, question, index=None):
+    positions, rows = _filter(frame, plan, index)
+    valuation_text, tables = _valuation(frame, positions)
+    if not plan.brand:
+        rows = rows.sample(min(100, len(rows)))
+    matched_brands = [plan.brand] if plan.brand else []
+
+    with span("aggregate", rows_in=len(rows)) as s:
+        brand_group = rows.groupby("Brand", observed=True).agg({
+            "Price": "mean", "Year": "mean", "Kilometers": "mean"
+        }).reset_index()
+
+        model_group = rows.groupby(["Brand", "Model"], observed=True).agg({
+            "Price": "mean",
+            "Year": "mean",
+            "Kilometers": "mean",
+            "Model": "count"
+        }).rename(columns={"Model": "Count"}).reset_index()
+
+        model_group.columns = ["Brand", "Model", "Avg Price", "Avg Year", "Avg Km", "Count"]
+        s.rows_out = len(model_group)
+
+    with span("serialize", rows_in=len(brand_group) + len(model_group)):
+        brand_table = brand_group.to_markdown(index=False)
+        model_table = model_group.to_markdown(index=False)
+        data_text = brand_group.to_csv(index=False) + model_group.to_csv(index=False)
+
+    prompt = f"""
+You are a professional car market analyst in Dubai.
+
+A user asked: "{question}"
+
+Here is the dataset filtered by brand(s): {', '.join(matched_brands) if matched_brands else 'Random Sample'}.
+
+First, a brand-level summary:
+
+{brand_table}
+
+Then, model-level details:
+
+{model_table}
+{valuation_text}
+Please perform the following:
+1. Compare all mentioned brands and their models.
+2. Create Markdown tables and highlight differences in price, age, mileage.
+3. Analyze differences between the models and which stand out.
+4. Provide summary recommendation.
+5. Based on the analysis, provide practical suggestions for buyers (e.g., which models or years offer the best value, which to avoid, etc.)
+"""
+    tables.update(brands=brand_group, models=model_group)
+    return Analysis(BRAND_MARKET, plan, prompt, data_text + valuation_text, 5000, rows, tables=tables)
+
+
+def overall_analysis(frame, plan, question, index=None):
+    positions, data = _filter(frame, plan, index)
+    valuation_text, tables = _valuation(frame, positions)
+    with span("aggregate", rows_in=len(data)) as s:
+        brand_summary = data.groupby("Brand", observed=True).agg({
+            "Model": "nunique",
+            "Price": ["mean", "min", "max"],
+            "Year": "mean",
+            "Kilometers": "mean"
+        }).reset_index()
+        brand_summary.columns = ['Brand', 'Model Count', 'Avg Price', 'Min Price', 'Max Price', 'Avg Year', 'Avg Km']
+
+        overall = pd.DataFrame({
+            'Brand': ['Overall'],
+            'Model Count': [brand_summary['Model Count'].sum()],
+            'Avg Price': [data['Price'].mean()],
+            'Min Price': [data['Price'].min()],
+            'Max Price': [data['Price'].max()],
+            'Avg Year': [data['Year'].mean()],
+            'Avg Km': [data['Kilometers'].mean()]
+        })
+
+        brand_summary = pd.concat([brand_summary, overall], ignore_index=True)
+        s.rows_out = len(brand_summary)
+
+    with span("serialize", rows_in=len(brand_summary)):
+        summary_table = brand_summary.to_markdown(index=False)
+        data_text = brand_summary.to_csv(index=False)
+
+    prompt = f"""
+You are a professional automotive market analyst in Dubai.
+
+The user asked: "{question}"
+
+Here is a summary of the entire used car dataset (10,000+ records), generated from real data.
+
+Brand-level statistics including an overall row at the bottom:
+
+{summary_table}
+{valuation_text}
+Please:
+1. Identify major market trends across price, mileage, and year.
+2. Highlight which brands are high-end vs affordable.
+3. Comment on how mileage correlates with price or year.
+4. Suggest which segments (brands/models) offer the best value.
+5. Write like you're briefing a business executive team in simple, clear terms.
+6. Based on the analysis, provide practical suggestions for buyers (e.g., which brands or years offer the best value, which to avoid, etc.)
+"""
+    tables["brands"] = brand_summary
+    return Analysis(OVERALL, plan, prompt, data_text + valuation_text, 5000, data, tables=tables)
+
+
+def run_analysis(question, frame, store=None, showroom_frames=(), history_view=UNIQUE):
+    """Plan ``question`` against ``frame`` and run its mode; ``None`` if no mode matched."""
+    index = get_index(frame)
+    plan = plan_question(question, index)
+    if plan.mode == CONDITION:
+        return condition_analysis(frame, plan, question, index)
+    if plan.mode == HISTORY_LINE:
+        if store is None or not plan.brand or not plan.model:
+            return Analysis(HISTORY_LINE, plan, max_tokens=3000)
+        return history_analysis(store, plan, showroom_frames, history_view)
+    if plan.mode == BRAND_MARKET:
+        return brand_market_analysis(frame, plan, question, index)
+    if plan.mode == OVERALL:
+        return overall_analysis(frame, plan, question, index)
+    return None
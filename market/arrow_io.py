@@ -0,0 +1,32 @@
+"""Conversion to, atomic writes of and memory-mapped reads of Arrow IPC files."""
+
+import os
+import uuid
+
+import pyarrow as pa
+
+
+def to_ipc_table(frame, schema):
+    """``frame`` as a table with exactly ``schema``; missing columns are all null."""
+    columns = {}
+    for field in schema:
+        if field.name in frame.columns:
+            columns[field.name] = pa.array(frame[field.name], from_pandas=True).cast(field.type)
+        else:
+            columns[field.name] = pa.nulls(len(frame), field.type)
+    # IPC files allow a single dictionary per column: collapse any chunks.
+    return pa.table(columns, schema=schema).unify_dictionaries().combine_chunks()
+
+
+def write_ipc(table, path):
+    """Write ``table`` to ``path`` via a temp file so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def read_ipc(path):
+    """Open ``path`` memory-mapped; buffers are paged in only when touched."""
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
@@ -0,0 +1,210 @@
+"""Answer a batch of questions without the Streamlit UI.
+
+Reads one question per line from a JSONL file (``{"id": ..., "question":
+...}`` objects or bare JSON strings), loads the market data once and runs
+every question through :func:`~market.analysis.run_analysis` on a bounded
+thread pool.  Answers go through the same response cache as the app, so a
+nightly run over the most asked brand/model reports warms it for every
+user::
+
+    python -m market.batch questions.jsonl --data data/dubai_market_latest.csv --out answers.jsonl
+
+Dated market files among ``--data`` are added to the snapshot store, as
+uploads are in the app, so history line questions see them.
+
+Each result is written as one JSON line as soon as it is ready; the
+summary (questions per second, latency percentiles, cache hits) goes to
+stderr.  ``--no-llm`` answers only from the cache and rankings, which also
+benchmarks the analysis pipeline on its own.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from market.analysis import GPT_MODEL, TEMPERATURE, run_analysis
+from market.dedup import UNIQUE, VIEWS
+from market.llm import get_llm_service
+from market.llm_cache import get_response_cache
+from market.matcher import get_index
+from market.prompting import count_tokens
+from market.remote import load_remote
+from market.store import SnapshotStore, get_snapshot_store
+from market.tracing import Trace, activate, finish_trace
+from market.valuation import get_valuation
+
+DEFAULT_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+
+def read_questions(path):
+    """``(id, question)`` pairs from a JSONL file; ids default to the line number."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            questions.append((item.get("id", number), item["question"]))
+    return questions
+
+
+class BatchRunner:
+    """Answers questions against one shared, already loaded dataset.
+
+    Safe to call from many threads: the frame, its brand/model index and
+    valuation are built once up front and only read afterwards.
+    """
+
+    def __init__(self, frame, store=None, showroom_frames=(), llm=None, cache=None,
+                 use_llm=True, history_view=UNIQUE):
+        self.frame = frame
+        self.store = store
+        self.showroom_frames = list(showroom_frames)
+        # --no-llm runs never need the OpenAI client (or its credentials).
+        self.llm = llm if llm is not None or not use_llm else get_llm_service()
+        self.cache = cache or get_response_cache()
+        self.use_llm = use_llm
+        self.history_view = history_view
+        # Shared per-frame state is built here, not raced for by the workers.
+        get_index(frame)
+        get_valuation(frame)
+
+    def answer(self, question_id, question):
+        trace = Trace(kind="batch")
+        started = time.perf_counter()
+        result = {"id": question_id, "question": question}
+        try:
+            with activate(trace):
+                result.update(self._answer(question))
+        except Exception as error:
+            result.update(status="error", error=f"{type(error).__name__}: {error}")
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        finish_trace(trace, mode=result.get("mode"), status=result["status"])
+        return result
+
+    def _answer(self, question):
+        analysis = run_analysis(question, self.frame, self.store, self.showroom_frames, self.history_view)
+        if analysis is None:
+            return {"status": "no mode"}
+        result = {"mode": analysis.mode}
+        if analysis.plan.rankings_only:
+            deals = analysis.tables.get("deals")
+            rankings = [] if deals is None else json.loads(deals.to_json(orient="records"))
+            return dict(result, status="ranked", rankings=rankings)
+        if analysis.prompt is None:
+            return dict(result, status="no data")
+
+        key = analysis.response_key()
+        answer = self.cache.get(key)
+        if answer is not None:
+            return dict(result, status="cached", answer=answer)
+        if not self.use_llm:
+            return dict(result, status="skipped", prompt_tokens=count_tokens(analysis.prompt))
+
+        prompt_tokens = count_tokens(analysis.prompt)
+        answer, usage = self.llm.complete(analysis.messages(), GPT_MODEL, temperature=TEMPERATURE,
+                                          max_tokens=analysis.max_tokens, estimated_tokens=prompt_tokens)
+        self.cache.put(key, answer, mode=analysis.mode)
+        return dict(result, status="answered", answer=answer, prompt_tokens=prompt_tokens,
+                    completion_tokens=getattr(usage, "completion_tokens", None))
+
+    def run(self, questions, max_workers=DEFAULT_WORKERS, on_result=None):
+        """Answer ``questions`` (``(id, question)`` pairs) on ``max_workers`` threads.
+
+        ``on_result(result)`` is called on the calling thread as each one
+        finishes; results are returned in input order.
+        """
+        results = [None] * len(questions)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="batch") as pool:
+            futures = {pool.submit(self.answer, qid, q): i for i, (qid, q) in enumerate(questions)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if on_result is not None:
+                    on_result(results[futures[future]])
+        return results
+
+
+def summarize(results, seconds):
+    latencies = np.array([r["seconds"] for r in results]) if results else np.zeros(1)
+    return {
+        "questions": len(results),
+        "seconds": round(seconds, 3),
+        "qps": round(len(results) / seconds, 2) if seconds > 0 else None,
+        "p50": round(float(np.percentile(latencies, 50)), 4),
+        "p95": round(float(np.percentile(latencies, 95)), 4),
+        "status": dict(Counter(r["status"] for r in results)),
+    }
+
+
+def load_data(sources, store=None):
+    """First dated market file (else the first undated one) plus any showroom files, via the shared registry.
+
+    Dated market files are also appended to ``store``, as uploads are in
+    the app, so history line questions can use them.
+    """
+    dated, undated, showroom, leases = None, None, [], []
+    for source in sources:
+        loaded, _ = load_remote(source)
+        leases.append(loaded.lease)
+        if loaded.is_showroom and not loaded.has_date:
+            showroom.append(loaded.frame)
+            continue
+        if loaded.has_date and store is not None and not store.has_source(loaded.digest):
+            store.append(loaded.frame, loaded.digest)
+        if loaded.has_date and dated is None:
+            dated = loaded.frame
+        elif undated is None:
+            undated = loaded.frame
+    frame = dated if dated is not None else undated
+    if frame is None:
+        raise SystemExit("no market data among --data sources")
+    return frame, showroom, leases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="JSONL file of questions")
+    parser.add_argument("--data", action="append", required=True,
+                        help="market CSV/Parquet path or URL (repeatable; showroom files are recognized by name)")
+    parser.add_argument("--store", help="snapshot store directory for history line questions; dated --data "
+                                        "files are added to it (default: SNAPSHOT_STORE_DIR)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--out", help="write result lines here (default: stdout)")
+    parser.add_argument("--no-llm", action="store_true", help="only serve cached answers and rankings")
+    parser.add_argument("--history-view", choices=VIEWS, default=UNIQUE)
+    args = parser.parse_args(argv)
+
+    questions = read_questions(args.questions)
+    store = SnapshotStore(args.store) if args.store else get_snapshot_store()
+    frame, showroom, leases = load_data(args.data, store)  # leases keep the frames registered for the run
+    runner = BatchRunner(frame, store, showroom, use_llm=not args.no_llm, history_view=args.history_view)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+
+    def write(result):
+        out.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+        out.flush()
+
+    started = time.perf_counter()
+    try:
+        results = runner.run(questions, max_workers=args.workers, on_result=write)
+    finally:
+        if args.out:
+            out.close()
+    summary = summarize(results, time.perf_counter() - started)
+    summary["workers"] = args.workers
+    print(json.dumps(summary), file=sys.stderr)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Headless benchmark of the analysis pipelines on synthetic data.
+
+Generates market snapshots with the brand/model mix, price, year and
+mileage distributions of the bundled CSVs (``data/`` and ``testdata/``),
+then runs every stage the app runs — CSV parse and normalization,
+snapshot store ingest, question planning, each mode's analysis, the
+history chart spec and the chat completion — without Streamlit and
+against :mod:`market.llm_stub` instead of the OpenAI API::
+
+    python -m market.bench --rows 10000,100000 --snapshots 1,30 --out bench.jsonl
+
+Every stage is written as one JSON line with its wall time, rows in and
+out, prompt tokens and memory (current and peak RSS, plus the traced
+Python/NumPy peak with ``--tracemalloc``), so runs from different versions
+can be compared with any JSONL tool.
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from openai import OpenAI
+
+from market.analysis import GPT_MODEL, run_analysis
+from market.charts import trend_chart
+from market.ingest import content_hash, parse_csv_bytes
+from market.llm import LLMService
+from market.llm_stub import start_stub
+from market.normalize import normalize_frame
+from market.prompting import count_tokens
+from market.store import SnapshotStore
+from market.tracing import Trace, activate, rss_mb
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_SOURCES = ("data/dubai_market_latest.csv", "testdata/dubizzle_split_*.csv")
+FIRST_DATE = pd.Timestamp("2025-01-01")
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class Recorder:
+    """Collects one record per timed stage.
+
+    Spans opened inside a stage (see :mod:`market.tracing`) are added as
+    ``<stage>/<span>`` records, so e.g. ``analysis/filter`` and
+    ``analysis/serialize`` are reported separately.
+    """
+
+    def __init__(self, context, trace_memory=False):
+        self.context = context
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def stage(self, name, fn, rows_in=None, rows_out=len, **fields):
+        if self.trace_memory:
+            tracemalloc.start()
+        rss = rss_mb()
+        trace = Trace()
+        started = time.perf_counter()
+        with activate(trace):
+            result = fn()
+        seconds = time.perf_counter() - started
+        record = dict(self.context, stage=name, seconds=round(seconds, 6), rows_in=rows_in, **fields)
+        record["rows_out"] = rows_out(result) if rows_out else None
+        record["rss_mb"] = round(rss_mb(), 1)
+        record["rss_delta_mb"] = round(record["rss_mb"] - rss, 1)
+        record["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        if self.trace_memory:
+            record["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        self.records.append(record)
+        for s in trace.spans:
+            self.records.append(dict(self.context, **dict(s.to_dict(), stage=f"{name}/{s.name}")))
+        return result
+
+
+def load_profile(root=REPO_ROOT, sources=PROFILE_SOURCES):
+    """Per-(Brand, Model) distributions of the bundled sample data."""
+    frames = []
+    for pattern in sources:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            frames.append(normalize_frame(pd.read_csv(path, encoding="utf-8-sig")))
+    sample = pd.concat(frames, ignore_index=True)[["Brand", "Model", "Price", "Year", "Kilometers"]].dropna()
+    sample = sample[sample["Price"] > 0]
+    sample = sample.assign(LogPrice=np.log(sample["Price"].astype("float64")),
+                           Year=sample["Year"].astype("float64"))
+    profile = sample.groupby(["Brand", "Model"], observed=True).agg(
+        Listings=("LogPrice", "size"),
+        LogPrice=("LogPrice", "mean"),
+        LogPriceStd=("LogPrice", "std"),
+        Year=("Year", "mean"),
+        YearStd=("Year", "std"),
+    ).reset_index()
+    profile[["LogPriceStd", "YearStd"]] = profile[["LogPriceStd", "YearStd"]].fillna(0.0)
+    profile["Weight"] = profile["Listings"] / profile["Listings"].sum()
+    return profile
+
+
+def synthetic_frame(profile, rows, snapshots=1, seed=0):
+    """``rows`` normalized listings spread evenly over ``snapshots`` daily dates."""
+    rng = np.random.default_rng(seed)
+    pick = rng.choice(len(profile), size=rows, p=profile["Weight"].to_numpy())
+    p = profile.iloc[pick]
+    year = np.clip(np.round(p["Year"].to_numpy() + rng.normal(0, 1, rows) * np.maximum(p["YearStd"].to_numpy(), 1.0)),
+                   1995, FIRST_DATE.year)
+    age = FIRST_DATE.year - year
+    km = np.maximum(0, age * rng.normal(18000, 6000, rows)).round(-2)
+    log_price = (p["LogPrice"].to_numpy() + 0.06 * (year - p["Year"].to_numpy()) - 0.05 * np.log1p(km / 60000)
+                 + rng.normal(0, 1, rows) * np.maximum(p["LogPriceStd"].to_numpy(), 0.05))
+    brands = pd.Categorical(p["Brand"].astype(str))
+    models = pd.Categorical(p["Model"].astype(str))
+    frame = pd.DataFrame({
+        "Brand": brands,
+        "Model": models,
+        "Title": pd.Series(brands).astype(str) + " " + pd.Series(models).astype(str) + " " + year.astype(int).astype(str),
+        "Price": np.exp(log_price).round(-2).astype(np.float32),
+        "Year": pd.array(year.astype(np.int16), dtype="Int16"),
+        "Kilometers": km.astype(np.float32),
+        "Date": FIRST_DATE + pd.to_timedelta(np.arange(rows) % max(1, snapshots), unit="D"),
+    })
+    return frame
+
+
+def snapshot_csvs(frame):
+    """Render each dated slice the way the scraped CSVs look (``m/d/Y`` dates, ``1,234 km``)."""
+    for day, rows in frame.groupby("Date", sort=True):
+        text = rows.assign(
+            Price=rows["Price"].map("{:,.0f}".format),
+            Kilometers=rows["Kilometers"].map("{:,.0f} km".format),
+            Date=day.strftime("%m/%d/%Y"),
+        )
+        yield day, text.to_csv(index=False).encode("utf-8")
+
+
+def questions_for(frame):
+    """One question per mode, about the most listed brand/model of ``frame``."""
+    top = frame.groupby(["Brand", "Model"], observed=True).size().idxmax()
+    brand, model = (str(v) for v in top)
+    return {
+        "condition": f"condition: {brand} {model} under 150,000 km below 200000",
+        "history line": f'history line brand-"{brand}" model-"{model}"',
+        "brand market": f'brand market brand-"{brand}"',
+        "overall": "overall market trend",
+    }
+
+
+def run_case(rows, snapshots, profile, llm, workdir, recorder_context=None, trace_memory=False, seed=0):
+    context = dict(recorder_context or {}, rows=rows, snapshots=snapshots)
+    rec = Recorder(dict(context, mode="ingest"), trace_memory)
+
+    frame = rec.stage("generate", lambda: synthetic_frame(profile, rows, snapshots, seed))
+    csvs = rec.stage("render_csv", lambda: list(snapshot_csvs(frame)), rows_in=rows, rows_out=None,
+                     files=snapshots)
+    parsed = rec.stage("parse_csv", lambda: [parse_csv_bytes(data) for _, data in csvs], rows_in=rows,
+                       rows_out=lambda frames: sum(len(f) for f in frames),
+                       csv_bytes=sum(len(data) for _, data in csvs))
+
+    store = SnapshotStore(os.path.join(workdir, f"store-{rows}-{snapshots}"))
+
+    def ingest(csvs, parsed):
+        for (_, data), part in zip(csvs, parsed):
+            store.append(part, content_hash(data))
+        return store.dates()
+
+    rec.stage("store_append", lambda: ingest(csvs, parsed), rows_in=rows, rows_out=None)
+    csvs = parsed = None  # release the rendered and parsed snapshots before the analysis stages
+
+    records = rec.records
+    for mode, question in questions_for(frame).items():
+        rec = Recorder(dict(context, mode=mode), trace_memory)
+        analysis = rec.stage("analysis", lambda: run_analysis(question, frame, store), rows_in=rows,
+                             rows_out=lambda a: len(a.rows) if a is not None and a.rows is not None else 0)
+        if analysis is None or analysis.prompt is None:
+            records += rec.records
+            continue
+        if mode == "history line":
+            spec = rec.stage("chart", lambda: json.dumps(trend_chart(
+                analysis.rows, analysis.tables["median"], analysis.tables["showroom"])[0].to_dict()),
+                rows_in=len(analysis.rows), rows_out=None)
+            rec.records[-1]["spec_bytes"] = len(spec)
+        messages = analysis.messages()
+        prompt_tokens = count_tokens(analysis.prompt)
+        rec.stage("llm", lambda: llm.complete(messages, GPT_MODEL, max_tokens=analysis.max_tokens,
+                                               estimated_tokens=prompt_tokens),
+                  rows_out=None, prompt_tokens=prompt_tokens,
+                  prompt_level=analysis.prompt_table.level if analysis.prompt_table else None)
+        records += rec.records
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="10000,100000", help="comma-separated total listing counts")
+    parser.add_argument("--snapshots", default="1,30", help="comma-separated numbers of daily snapshots")
+    parser.add_argument("--out", help="append JSON lines here (default: stdout)")
+    parser.add_argument("--label", default="", help="tag every record, e.g. a git revision")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub latency in seconds")
+    parser.add_argument("--tracemalloc", action="store_true", help="also record traced peak memory (slower)")
+    parser.add_argument("--workdir", help="where snapshot stores are written (default: a temp dir)")
+    args = parser.parse_args(argv)
+
+    server, base_url = start_stub(latency=args.llm_latency)
+    # No client-side rate limits: the stub answers instantly, so only pipeline time is measured.
+    llm = LLMService(client=OpenAI(api_key="bench", base_url=base_url, max_retries=0),
+                     requests_per_minute=1e9, tokens_per_minute=1e12)
+    profile = load_profile()
+    out = open(args.out, "a") if args.out else sys.stdout
+    try:
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            for rows in (int(r) for r in args.rows.split(",")):
+                for snapshots in (int(s) for s in args.snapshots.split(",")):
+                    records = run_case(rows, snapshots, profile, llm, workdir,
+                                       recorder_context={"label": args.label}, trace_memory=args.tracemalloc,
+                                       seed=args.seed)
+                    for record in records:
+                        out.write(json.dumps(record) + "\n")
+                    out.flush()
+                    if args.out:
+                        total = sum(r["seconds"] for r in records)
+                        print(f"rows={rows} snapshots={snapshots}: {total:.2f}s", file=sys.stderr)
+    finally:
+        if args.out:
+            out.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Altair chart for the history line view.
+
+The blue market layer is reduced on the server once a query matches more
+than ``CHART_MAX_POINTS`` listings, so the Vega-Lite spec sent to the
+browser stays roughly the same size however long the history gets:
+
+* ``points``: every listing (small results, unchanged behaviour);
+* ``bands``: per-date p10-p90 and p25-p75 price bands plus the listings
+  outside the Tukey fences, capped at ``CHART_MAX_OUTLIERS``;
+* ``density``: a fixed grid of date x price bins coloured by count.
+
+The red median line and the gold showroom rules are always drawn from the
+full data.
+"""
+
+import os
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "3000"))
+CHART_MAX_OUTLIERS = int(os.getenv("CHART_MAX_OUTLIERS", "300"))
+CHART_REDUCTION = os.getenv("CHART_REDUCTION", "bands")  # or "density"
+DENSITY_BINS = (60, 40)
+
+BAND_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+POINT_COLUMNS = ["Date", "Price", "Kilometers", "Year"]
+
+
+def choose_reduction(n_rows, max_points=CHART_MAX_POINTS, reduction=CHART_REDUCTION):
+    return "points" if n_rows <= max_points else reduction
+
+
+def daily_bands(history_df):
+    prices = history_df[["Date", "Price"]].astype({"Price": "float64"})
+    bands = prices.groupby("Date")["Price"].quantile(list(BAND_QUANTILES)).unstack()
+    bands.columns = [f"q{int(round(q * 100))}" for q in BAND_QUANTILES]
+    return bands.reset_index()
+
+
+def outliers(history_df, bands, limit=CHART_MAX_OUTLIERS):
+    """Listings outside each day's Tukey fences, the most extreme ``limit`` of them."""
+    rows = history_df[POINT_COLUMNS].merge(bands[["Date", "q25", "q75"]], on="Date", how="left")
+    iqr = (rows["q75"] - rows["q25"]).clip(lower=1.0)
+    distance = np.maximum(rows["q25"] - rows["Price"], rows["Price"] - rows["q75"]) / iqr
+    extreme = rows[distance > 1.5].assign(_distance=distance[distance > 1.5])
+    return extreme.nlargest(limit, "_distance")[POINT_COLUMNS]
+
+
+def density_grid(history_df, bins=DENSITY_BINS):
+    rows = history_df[["Date", "Price"]].dropna()
+    dates = rows["Date"].to_numpy().astype("datetime64[ns]").astype(np.int64)
+    n_dates = max(1, rows["Date"].nunique())
+    counts, x_edges, y_edges = np.histogram2d(
+        dates, rows["Price"].to_numpy(dtype=np.float64), bins=(min(bins[0], n_dates), bins[1]),
+    )
+    xi, yi = np.nonzero(counts)
+    return pd.DataFrame({
+        "x_start": pd.to_datetime(x_edges[xi].astype(np.int64)),
+        "x_end": pd.to_datetime(x_edges[xi + 1].astype(np.int64)),
+        "y_start": y_edges[yi],
+        "y_end": y_edges[yi + 1],
+        "Listings": counts[xi, yi].astype(int),
+    })
+
+
+def market_layer(history_df, reduction):
+    if reduction == "points":
+        return alt.Chart(history_df[POINT_COLUMNS]).mark_circle(size=60, color='steelblue').encode(
+            x=alt.X('Date:T', title='Date'),
+            y=alt.Y('Price:Q', title='Price (AED)'),
+            tooltip=[
+                alt.Tooltip('Date:T'),
+                alt.Tooltip('Price:Q'),
+                alt.Tooltip('Kilometers:Q'),
+                alt.Tooltip('Year:Q')
+            ]
+        )
+
+    if reduction == "density":
+        return alt.Chart(density_grid(history_df)).mark_rect(opacity=0.8).encode(
+            x=alt.X('x_start:T', title='Date'),
+            x2='x_end:T',
+            y=alt.Y('y_start:Q', title='Price (AED)'),
+            y2='y_end:Q',
+            color=alt.Color('Listings:Q', scale=alt.Scale(scheme='blues')),
+            tooltip=[alt.Tooltip('Listings:Q'), alt.Tooltip('y_start:Q', title='Price from'),
+                     alt.Tooltip('y_end:Q', title='Price to')]
+        )
+
+    bands = daily_bands(history_df)
+    outer = alt.Chart(bands).mark_area(color='steelblue', opacity=0.2).encode(
+        x=alt.X('Date:T', title='Date'),
+        y=alt.Y('q10:Q', title='Price (AED)'),
+        y2='q90:Q',
+        tooltip=[alt.Tooltip('Date:T'), alt.Tooltip('q10:Q', title='P10'), alt.Tooltip('q90:Q', title='P90')]
+    )
+    inner = alt.Chart(bands).mark_area(color='steelblue', opacity=0.4).encode(
+        x='Date:T',
+        y='q25:Q',
+        y2='q75:Q',
+        tooltip=[alt.Tooltip('Date:T'), alt.Tooltip('q25:Q', title='P25'), alt.Tooltip('q75:Q', title='P75')]
+    )
+    extreme = alt.Chart(outliers(history_df, bands)).mark_circle(size=40, color='steelblue').encode(
+        x='Date:T',
+        y='Price:Q',
+        tooltip=[
+            alt.Tooltip('Date:T'),
+            alt.Tooltip('Price:Q'),
+            alt.Tooltip('Kilometers:Q'),
+            alt.Tooltip('Year:Q')
+        ]
+    )
+    return outer + inner + extreme
+
+
+def trend_chart(history_df, median_df, showroom_df, max_points=CHART_MAX_POINTS, reduction=CHART_REDUCTION):
+    """Return ``(chart, reduction)`` for the market data, median trend and showroom prices."""
+    reduction = choose_reduction(len(history_df), max_points, reduction)
+    layers = market_layer(history_df, reduction)
+
+    # 红色中位数点+线
+    median_line = alt.Chart(median_df).mark_line(color='red', strokeWidth=2).encode(
+        x='Date:T',
+        y='MedianPrice:Q'
+    )
+    median_point = alt.Chart(median_df).mark_point(color='red', size=80, filled=True).encode(
+        x='Date:T',
+        y='MedianPrice:Q',
+        tooltip=[
+            alt.Tooltip('Date:T'),
+            alt.Tooltip('MedianPrice:Q'),
+            alt.Tooltip('Kilometers:Q', title="Avg Mileage"),
+            alt.Tooltip('Year:Q', title="Avg Year")
+        ]
+    )
+    layers = layers + median_line + median_point
+
+    # 黄色 showroom 横线（跨所有日期范围）
+    if not showroom_df.empty:
+        showroom = showroom_df[["Price", "Kilometers", "Year"]].assign(
+            x_start=history_df["Date"].min(),
+            x_end=history_df["Date"].max(),
+        )
+        showroom_lines = alt.Chart(showroom).mark_rule(
+            color='gold',
+            strokeDash=[3, 3]
+        ).encode(
+            x='x_start:T',
+            x2='x_end:T',
+            y='Price:Q',
+            tooltip=[
+                alt.Tooltip('Price:Q', title="Showroom Price"),
+                alt.Tooltip('Kilometers:Q'),
+                alt.Tooltip('Year:Q')
+            ]
+        )
+        layers = layers + showroom_lines
+
+    return layers, reduction
@@ -0,0 +1,149 @@
+"""Recognize the same listing across daily snapshots.
+
+A Dubizzle ad stays up for days, so it appears once in every daily file
+it was live in.  :func:`fingerprint` hashes the normalized Title, Brand,
+Model, Year and Kilometers of each row into one 64-bit key with
+``pd.util.hash_pandas_object``; :func:`track_listings` then groups rows
+by that key (a hash join over every snapshot at once, never pairwise
+comparisons) and returns two views of the same history:
+
+* ``daily``: one row per listing per snapshot date, with its ``ListingId``
+  and whether that date is the first one it was seen (``New``);
+* ``listings``: one row per listing with ``FirstSeen`` / ``LastSeen``,
+  the number of snapshots it was in, its first and latest price and how
+  many times the price changed.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from market.tracing import span
+
+UNIQUE = "unique listings"
+DAILY = "daily snapshots"
+VIEWS = (UNIQUE, DAILY)
+
+FINGERPRINT_COLUMNS = ("Title", "Brand", "Model", "Year", "Kilometers")
+LISTING_COLUMNS = ["ListingId", "Brand", "Model", "Title", "Year", "Kilometers",
+                   "FirstSeen", "LastSeen", "Days", "FirstPrice", "Price", "PriceChanges"]
+
+
+def _normalized_text(series):
+    text = series.astype("string").fillna("").str.lower()
+    return text.str.replace(r"\W+", " ", regex=True).str.strip()
+
+
+def _text_hash(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Normalize and hash each category once, then look codes up.
+        hashed = pd.util.hash_pandas_object(_normalized_text(pd.Series(series.cat.categories)), index=False)
+        lookup = np.append(hashed.to_numpy(), pd.util.hash_pandas_object(pd.Series([""]), index=False).to_numpy())
+        return lookup[series.cat.codes.to_numpy()]  # code -1 (missing) hashes as ""
+    return pd.util.hash_pandas_object(_normalized_text(series), index=False).to_numpy()
+
+
+def fingerprint(frame):
+    """One ``uint64`` key per row of ``frame`` identifying the listing behind it.
+
+    Case, punctuation and spacing of the text fields are ignored; mileage
+    is compared in whole kilometres.  Missing columns hash as empty.
+    """
+    parts = {}
+    for name in FINGERPRINT_COLUMNS:
+        if name not in frame.columns:
+            parts[name] = np.zeros(len(frame), dtype=np.uint64)
+        elif name in ("Year", "Kilometers"):
+            values = frame[name].to_numpy(dtype=np.float64, na_value=np.nan)
+            parts[name] = np.where(np.isnan(values), -1, np.round(values)).astype(np.int64)
+        else:
+            parts[name] = _text_hash(frame[name])
+    # Text is hashed column by column above; combining fixed-width columns is cheap.
+    return pd.util.hash_pandas_object(pd.DataFrame(parts, index=frame.index), index=False).to_numpy()
+
+
+@dataclass
+class ListingHistory:
+    daily: pd.DataFrame
+    listings: pd.DataFrame
+
+    @property
+    def repeated(self):
+        """Snapshot rows that were a listing already seen on an earlier date."""
+        return int((~self.daily["New"]).sum())
+
+    @property
+    def price_changed(self):
+        return int((self.listings["PriceChanges"] > 0).sum())
+
+
+def track_listings(history):
+    """Deduplicate ``history`` (listing rows with a ``Date``) into a :class:`ListingHistory`."""
+    with span("dedup", rows_in=len(history)) as s:
+        rows = history.assign(ListingId=fingerprint(history))
+        # The same ad twice in one day's file is one listing that day.
+        daily = rows.drop_duplicates(["ListingId", "Date"]).sort_values(["ListingId", "Date"], kind="stable")
+
+        ids = daily["ListingId"].to_numpy()
+        price = daily["Price"].to_numpy(dtype=np.float64, na_value=np.nan)
+        same_listing = np.r_[False, ids[1:] == ids[:-1]]
+        previous = np.r_[np.nan, price[:-1]]
+        changed = same_listing & (price != previous) & ~np.isnan(price) & ~np.isnan(previous)
+        daily = daily.assign(New=~same_listing, PriceChanged=changed)
+
+        listings = daily.groupby("ListingId", sort=False).agg(
+            Brand=("Brand", "first"),
+            Model=("Model", "first"),
+            Title=("Title", "first"),
+            Year=("Year", "first"),
+            Kilometers=("Kilometers", "first"),
+            FirstSeen=("Date", "min"),
+            LastSeen=("Date", "max"),
+            Days=("Date", "size"),
+            FirstPrice=("Price", "first"),
+            Price=("Price", "last"),
+            PriceChanges=("PriceChanged", "sum"),
+        ).reset_index()[LISTING_COLUMNS]
+
+        daily = daily.drop(columns="PriceChanged").sort_values("Date", kind="stable")
+        s.rows_out = len(listings)
+        s.attrs["daily_rows"] = len(daily)
+    return ListingHistory(daily, listings)
+
+
+def unique_trend(listings):
+    """Per-date trend of listings by the date they were first seen, at their first price.
+
+    Same columns as :meth:`market.rollup.TrendRollup.trend`, so the chart
+    draws either view.
+    """
+    if listings.empty:
+        return pd.DataFrame(columns=["Date", "Count", "MedianPrice", "Kilometers", "Year"])
+    values = listings.assign(
+        Price=listings["FirstPrice"].astype("float64"),
+        Kilometers=listings["Kilometers"].astype("float64"),
+        Year=listings["Year"].astype("float64"),
+    )
+    return values.groupby("FirstSeen", sort=True).agg(
+        Count=("Price", "size"),
+        MedianPrice=("Price", "median"),
+        Kilometers=("Kilometers", "mean"),
+        Year=("Year", "mean"),
+    ).rename_axis("Date").reset_index()
+
+
+def unique_rows(listings):
+    """Listings as chart/prompt rows: dated when first seen, priced as first listed."""
+    return pd.DataFrame({
+        "Date": listings["FirstSeen"],
+        "Brand": listings["Brand"],
+        "Model": listings["Model"],
+        "Price": listings["FirstPrice"],
+        "Year": listings["Year"],
+        "Kilometers": listings["Kilometers"],
+        "LastPrice": listings["Price"],
+        "LastSeen": listings["LastSeen"],
+        "Days": listings["Days"],
+        "PriceChanges": listings["PriceChanges"],
+    }).sort_values("Date", kind="stable").reset_index(drop=True)
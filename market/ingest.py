@@ -0,0 +1,268 @@
+"""Content-addressed CSV ingest with a process-wide, memory-capped registry.
+
+Uploaded files are keyed by a hash of their bytes, so the same snapshot is
+parsed and normalized once per process no matter how many reruns or
+sessions ask for it, and every session gets the same frame rather than a
+copy.  Registered frames are shared and read-only: callers select rows by
+position and derive new frames (copy-on-write) instead of assigning
+columns in place.  A session keeps the frames it uses registered by
+holding their :class:`DatasetLease`; unheld frames are evicted LRU-first.
+
+:func:`load_many` ingests a batch of uploads on a thread pool with the
+multithreaded pyarrow CSV engine, reporting each file as it finishes; a
+file that fails is reported and skipped without aborting the others.
+"""
+
+import contextvars
+import hashlib
+import io
+import os
+import threading
+import weakref
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import pandas as pd
+import pyarrow as pa
+
+from market.normalize import normalize_frame
+from market.tracing import span
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("INGEST_CACHE_ENTRIES", "128"))
+DEFAULT_MAX_BYTES = int(os.getenv("INGEST_CACHE_MB", "512")) * 1024 * 1024
+DEFAULT_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(8, os.cpu_count() or 1))))
+CSV_ENGINE = os.getenv("INGEST_CSV_ENGINE", "pyarrow")
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class DatasetLease:
+    """A session's hold on one cached frame; the frame is not evicted while held.
+
+    Released explicitly with :meth:`release` or when the lease is
+    garbage-collected (e.g. with the Streamlit session that stored it).
+    """
+
+    def __init__(self, cache, key, frame, hit):
+        self.key = key
+        self.frame = frame
+        self.hit = hit
+        self._finalizer = weakref.finalize(self, cache._unpin, key)
+
+    @property
+    def active(self):
+        return self._finalizer.alive
+
+    def release(self):
+        self._finalizer()
+
+
+class FrameCache:
+    """Process-wide registry of normalized frames, keyed by content hash.
+
+    Each distinct dataset is parsed once, however many sessions load it at
+    the same time, and every caller gets the same frame object (and so the
+    same :func:`~market.matcher.get_index`).  Frames held through a
+    :class:`DatasetLease` are pinned; the rest are evicted least recently
+    used first once the entry count or byte budget is exceeded.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._pins = Counter()
+        self._released = deque()  # keys of leases released since the last cache call
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, frame):
+        size = frame_nbytes(frame)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (frame, size)
+            self._bytes += size
+            self._evict()
+
+    def acquire(self, key, loader):
+        """Lease the frame for ``key``, calling ``loader()`` only if nobody has it yet.
+
+        Concurrent callers with the same ``key`` wait for a single load.
+        """
+        with self._lock:
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._pins[key] += 1
+                    return DatasetLease(self, key, entry[0], hit=True)
+                self.misses += 1
+            try:
+                frame = loader()
+                size = frame_nbytes(frame)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)[1]
+                self._entries[key] = (frame, size)
+                self._bytes += size
+                self._pins[key] += 1
+                self._evict()
+                # Only now that the entry is visible may a later caller skip this lock.
+                self._loading.pop(key, None)
+            return DatasetLease(self, key, frame, hit=False)
+
+    def _unpin(self, key):
+        # Lease finalizers can run from garbage collection in the middle of
+        # another call on this thread that holds the lock, so only queue the
+        # release here; it is applied under the lock by the next cache call.
+        self._released.append(key)
+
+    def _drain(self):
+        while self._released:
+            key = self._released.popleft()
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+
+    def _evict(self):
+        self._drain()
+        # Least recently used first, skipping frames some session still holds.
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            self._bytes -= self._entries.pop(key)[1]
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every frame nobody holds a lease on."""
+        with self._lock:
+            self._drain()
+            for key in [k for k in self._entries if k not in self._pins]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            self._drain()
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "pinned": len(self._pins),
+                "leases": sum(self._pins.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+@dataclass(frozen=True)
+class IngestedFile:
+    name: str
+    digest: str
+    frame: pd.DataFrame
+    lease: DatasetLease = None  # keeps ``frame`` registered while this file is held
+
+    @property
+    def has_date(self):
+        return "Date" in self.frame.columns
+
+    @property
+    def is_showroom(self):
+        return "showroom" in self.name.lower()
+
+
+_frame_cache = FrameCache()
+
+
+def get_frame_cache():
+    return _frame_cache
+
+
+def parse_csv_bytes(data, engine=CSV_ENGINE):
+    if engine == "pyarrow":
+        try:
+            # Arrow skips the UTF-8 BOM itself and parses on several threads.
+            return normalize_frame(pd.read_csv(io.BytesIO(data), engine="pyarrow"))
+        except (pa.ArrowInvalid, ValueError):
+            pass  # ragged rows and the like: the C parser is more forgiving
+    raw = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig")
+    return normalize_frame(raw)
+
+
+def load_csv_bytes(data, name="", cache=None):
+    """Parse and normalize CSV bytes, reusing any frame cached for the same content."""
+    cache = cache or _frame_cache
+    with span("load_csv", file=name, bytes=len(data)) as s:
+        digest = content_hash(data)
+        lease = cache.acquire(digest, lambda: parse_csv_bytes(data))
+        s.attrs["cached"] = lease.hit
+        s.rows_out = len(lease.frame)
+    return IngestedFile(name=name, digest=digest, frame=lease.frame, lease=lease)
+
+
+def load_uploaded(file, cache=None):
+    """Ingest a Streamlit ``UploadedFile`` (or any object with ``getvalue``/``name``)."""
+    return load_csv_bytes(file.getvalue(), name=getattr(file, "name", ""), cache=cache)
+
+
+@dataclass(frozen=True)
+class IngestOutcome:
+    name: str
+    loaded: IngestedFile = None
+    error: Exception = None
+
+
+def load_many(files, max_workers=DEFAULT_WORKERS, progress=None, cache=None):
+    """Ingest ``files`` concurrently; returns one :class:`IngestOutcome` per file, in input order.
+
+    ``progress(outcome, done, total)`` is called on the calling thread as
+    each file finishes, so it may update the UI.
+    """
+    files = list(files)
+    outcomes = [None] * len(files)
+    if not files:
+        return outcomes
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files))), thread_name_prefix="ingest") as pool:
+        # Each file runs in a copy of this context, so its span lands in the caller's trace.
+        futures = {pool.submit(contextvars.copy_context().run, load_uploaded, f, cache): i
+                   for i, f in enumerate(files)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            name = getattr(files[i], "name", "")
+            try:
+                outcomes[i] = IngestOutcome(name, loaded=future.result())
+            except Exception as error:
+                outcomes[i] = IngestOutcome(name, error=error)
+            if progress is not None:
+                progress(outcomes[i], done, len(files))
+    return outcomes
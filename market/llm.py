@@ -0,0 +1,211 @@
+"""Process-wide access to the OpenAI chat completions API.
+
+Every Streamlit session (and every batch worker) goes through one
+:class:`LLMService`.  It owns a single ``OpenAI`` client, so its HTTP
+connection pool and keep-alive connections are reused across reruns and
+users.  It also shares capacity fairly between concurrent analyses:
+
+* a bounded number of requests in flight at once,
+* token buckets for requests/minute and tokens/minute, which queue
+  callers in arrival order instead of letting them race,
+* retry with exponential backoff and jitter on 429s, timeouts and 5xx
+  errors, honouring ``Retry-After`` when the server sends it.
+
+Point ``OPENAI_BASE_URL`` at :mod:`market.llm_stub` to exercise all of this
+without the real API.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from openai import OpenAI
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+DEFAULT_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "300000"))
+DEFAULT_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """Token bucket that hands out capacity in arrival order.
+
+    A caller reserves its cost immediately, possibly driving the balance
+    negative, and then sleeps until the bucket would have refilled to
+    cover it.  Later callers queue behind earlier reservations, so no
+    caller is starved under load.
+    """
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost=1.0):
+        """Reserve ``cost`` tokens and return how long the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= min(cost, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, cost=1.0):
+        wait = self.reserve(cost)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def retry_delay(attempt, error=None, base=0.5, cap=30.0):
+    """Full-jitter exponential backoff, or the server's ``Retry-After`` if present."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def stream_chat(client, messages, model, temperature=0.3, max_tokens=3000):
+    """Yield the text deltas of a streamed chat completion as they arrive.
+
+    Closing the generator early (the consumer breaks out, or the Streamlit
+    run is interrupted by a new query) closes the HTTP stream so the rest
+    of the completion is not generated for nobody.
+    """
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        stream.close()
+
+
+class LLMService:
+
+    def __init__(
+        self,
+        client=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+        max_retries=DEFAULT_MAX_RETRIES,
+    ):
+        # Retries are handled here, after the rate limiter, not inside the client.
+        self.client = client or OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, timeout=DEFAULT_TIMEOUT)
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 60.0))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute / 60.0 * 10)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self.retries = 0
+
+    def _throttle(self, estimated_tokens):
+        self.request_bucket.acquire(1)
+        self.token_bucket.acquire(estimated_tokens)
+
+    def _with_retries(self, call, estimated_tokens):
+        attempt = 0
+        while True:
+            self._throttle(estimated_tokens)
+            try:
+                return call()
+            except RETRYABLE_ERRORS as error:
+                if attempt >= self.max_retries:
+                    raise
+                self.retries += 1
+                time.sleep(retry_delay(attempt, error))
+                attempt += 1
+
+    def complete(self, messages, model, temperature=0.3, max_tokens=3000, estimated_tokens=0):
+        """Blocking completion; returns ``(text, usage)``."""
+        def call():
+            return self.client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, max_tokens=max_tokens,
+            )
+
+        with self._slots:
+            response = self._with_retries(call, estimated_tokens + max_tokens)
+        return response.choices[0].message.content, response.usage
+
+    def stream(self, messages, model, temperature=0.3, max_tokens=3000, estimated_tokens=0):
+        """Streamed completion holding one concurrency slot until the stream ends.
+
+        Only opening the stream is retried; once text has been yielded a
+        failure propagates to the caller.
+        """
+        with self._slots:
+            deltas = self._with_retries(
+                lambda: _open_stream(self.client, messages, model, temperature, max_tokens),
+                estimated_tokens + max_tokens,
+            )
+            try:
+                yield from deltas
+            finally:
+                deltas.close()
+
+    def submit(self, messages, model, temperature=0.3, max_tokens=3000, estimated_tokens=0):
+        """Run :meth:`complete` on the shared worker pool and return a ``Future``."""
+        return self._executor.submit(
+            self.complete, messages, model,
+            temperature=temperature, max_tokens=max_tokens, estimated_tokens=estimated_tokens,
+        )
+
+
+def _open_stream(client, messages, model, temperature, max_tokens):
+    # Pull the first delta eagerly so connection errors and 429s surface
+    # here, inside the retry loop, rather than in the consumer.
+    deltas = stream_chat(client, messages, model, temperature=temperature, max_tokens=max_tokens)
+    try:
+        first = next(deltas)
+    except StopIteration:
+        first = None
+    return _prepend(first, deltas)
+
+
+def _prepend(first, deltas):
+    try:
+        if first is not None:
+            yield first
+        yield from deltas
+    finally:
+        deltas.close()
+
+
+_default_service = None
+_default_lock = threading.Lock()
+
+
+def get_llm_service():
+    global _default_service
+    with _default_lock:
+        if _default_service is None:
+            _default_service = LLMService()
+    return _default_service
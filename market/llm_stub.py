@@ -0,0 +1,157 @@
+"""Local stand-in for the OpenAI chat completions endpoint.
+
+Serves ``POST /v1/chat/completions`` with canned answers, both as a single
+JSON response and as a server-sent-event stream, with configurable
+latency and injected 429s.  Point the app at it with
+``OPENAI_BASE_URL=http://127.0.0.1:<port>/v1`` for tests and benchmarks::
+
+    python -m market.llm_stub --port 8799 --latency 0.2 --rate-limit-every 5
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+
+    def __init__(self, latency=0.0, chunk_delay=0.0, rate_limit_every=0, retry_after=0.0, answer_words=60):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.answer_words = answer_words
+        self.requests = itertools.count(1)
+        self.stats = {"requests": 0, "rate_limited": 0, "streamed": 0, "prompt_chars": 0}
+        self.lock = threading.Lock()
+
+
+def _answer(body, words):
+    prompt = body["messages"][-1]["content"] if body.get("messages") else ""
+    text = " ".join(["stub"] * words)
+    return f"Stub analysis of a {len(prompt)}-character prompt. {text}"
+
+
+def _make_handler(config):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            blob = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(blob)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(blob)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            n = next(config.requests)
+            with config.lock:
+                config.stats["requests"] += 1
+                config.stats["prompt_chars"] += sum(len(m.get("content", "")) for m in body.get("messages", []))
+            if config.rate_limit_every and n % config.rate_limit_every == 0:
+                with config.lock:
+                    config.stats["rate_limited"] += 1
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                    headers={"Retry-After": str(config.retry_after)},
+                )
+                return
+
+            time.sleep(config.latency)
+            text = _answer(body, config.answer_words)
+            model = body.get("model", "gpt-4o")
+            prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                     "total_tokens": prompt_tokens + len(text) // 4}
+
+            if not body.get("stream"):
+                self._send_json(200, {
+                    "id": f"chatcmpl-stub-{n}", "object": "chat.completion", "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+                return
+
+            with config.lock:
+                config.stats["streamed"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                delta = {"content": word + (" " if i < len(words) - 1 else "")}
+                if i == 0:
+                    delta["role"] = "assistant"
+                chunk = {
+                    "id": f"chatcmpl-stub-{n}", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+                try:
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return  # client cancelled the stream
+                time.sleep(config.chunk_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+
+def start_stub(port=0, host="127.0.0.1", **config_kwargs):
+    """Start the stub in a daemon thread; returns ``(server, base_url)``.
+
+    ``server.config.stats`` counts requests; call ``server.shutdown()`` to stop.
+    """
+    config = StubConfig(**config_kwargs)
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every N-th request with 429")
+    parser.add_argument("--retry-after", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    server, base_url = start_stub(
+        port=args.port, host=args.host, latency=args.latency, chunk_delay=args.chunk_delay,
+        rate_limit_every=args.rate_limit_every, retry_after=args.retry_after,
+    )
+    print(f"LLM stub listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
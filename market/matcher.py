@@ -0,0 +1,183 @@
+"""Brand/model dictionary for resolving names mentioned in a question.
+
+A :class:`BrandModelIndex` is built once per loaded frame.  It holds a token
+trie over every canonical brand/model name (plus a few common aliases) and
+the row positions of each brand and (brand, model) pair, so a question is
+resolved in one left-to-right pass and filtering becomes index lookups
+instead of string scans over every row.
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+from market.memo import per_frame_cache
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_RAW_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+
+BRAND_ALIASES = {
+    "Mercedes-Benz": ("mercedes", "benz", "merc"),
+    "Volkswagen": ("vw",),
+    "Chevrolet": ("chevy",),
+    "Rolls-Royce": ("rolls royce", "rolls"),
+    "Land Rover": ("landrover",),
+    "Alfa Romeo": ("alfa",),
+    "Aston Martin": ("aston",),
+    "Lamborghini": ("lambo",),
+}
+
+# Model names that are ordinary words or bare numbers only count when they
+# directly follow their own brand ("Mazda 6", "Ford GT", "Fiat 500").
+_COMMON_WORDS = {
+    "other", "free", "one", "rich", "city", "van", "pickup", "coupe", "spider",
+    "delta", "dawn", "ghost", "crown", "roadster", "express", "cooper", "soul",
+    "leon", "flex", "edge", "rush", "escape", "venue", "focus", "fusion", "z",
+}
+
+# Brand names that are ordinary words only count when capitalized in the
+# question ("a Smart ForTwo") or directly followed by one of their own
+# models ("mini cooper"), so "a smart family car" is not a Smart.
+_COMMON_BRAND_WORDS = {
+    "smart", "mini", "ram", "genesis", "dodge", "seat", "tank", "victory", "jaguar", "lotus",
+}
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def _is_strict_model(tokens):
+    if len(tokens) > 1:
+        return False
+    token = tokens[0]
+    if token.isdigit() or token in _COMMON_WORDS:
+        return True
+    return len(token) < 3 and not (any(c.isdigit() for c in token) and any(c.isalpha() for c in token))
+
+
+@dataclass(frozen=True)
+class Mentions:
+    brands: tuple = ()
+    models: tuple = ()  # (brand, model) pairs
+
+    def __bool__(self):
+        return bool(self.brands or self.models)
+
+
+class BrandModelIndex:
+
+    def __init__(self, frame):
+        self.brand_rows = dict(frame.groupby("Brand", observed=True, sort=False).indices)
+        self.model_rows = dict(frame.groupby(["Brand", "Model"], observed=True, sort=False).indices)
+        self._trie = {}
+        self._depth = 1
+
+        for brand in self.brand_rows:
+            self._add(brand, ("brand", brand))
+            for alias in BRAND_ALIASES.get(brand, ()):
+                self._add(alias, ("brand", brand))
+        for brand, model in self.model_rows:
+            self._add(model, ("model", brand, model))
+
+    def _add(self, name, entry):
+        tokens = tokenize(name)
+        if not tokens:
+            return
+        if entry[0] == "model":
+            strict = _is_strict_model(tokens)
+        else:
+            strict = len(tokens) == 1 and tokens[0] in _COMMON_BRAND_WORDS
+        variants = [tokens]
+        if len(tokens) > 1:
+            variants.append(["".join(tokens)])  # "rav 4" and "rav4", "cr v" and "crv"
+        for variant in variants:
+            node = self._trie
+            for token in variant:
+                node = node.setdefault(token, {})
+            node.setdefault(None, []).append(entry + (strict,))
+            self._depth = max(self._depth, len(variant))
+
+    def _longest(self, tokens, i):
+        """Entries of the longest name starting at ``tokens[i]`` and where it ends."""
+        node, best, best_end = self._trie, None, i
+        for j in range(i, min(len(tokens), i + self._depth)):
+            node = node.get(tokens[j])
+            if node is None:
+                break
+            if None in node:
+                best, best_end = node[None], j + 1
+        return best, best_end
+
+    def _followed_by_model(self, tokens, i, brand):
+        entries, _ = self._longest(tokens, i)
+        return any(e[0] == "model" and e[1] == brand for e in entries or ())
+
+    def resolve(self, text):
+        """Return every brand and model named in ``text`` (longest match wins)."""
+        raw = _RAW_TOKEN_RE.findall(str(text))
+        tokens = [token.lower() for token in raw]
+        brands, models = [], []
+        last_brand = None
+        i = 0
+        while i < len(tokens):
+            best, best_end = self._longest(tokens, i)
+            if best is None:
+                i += 1
+                continue
+
+            hit_brands = [
+                e[1] for e in best
+                if e[0] == "brand" and (not e[2] or raw[i][0].isupper() or self._followed_by_model(tokens, best_end, e[1]))
+            ]
+            hit_models = [(e[1], e[2]) for e in best if e[0] == "model" and (not e[3] or e[1] == last_brand)]
+            if hit_brands:
+                last_brand = hit_brands[0]
+                brands.extend(b for b in hit_brands if b not in brands)
+            elif hit_models:
+                # A bare model name shared by several brands resolves to the
+                # one just mentioned, if any.
+                scoped = [m for m in hit_models if m[0] == last_brand] or hit_models
+                models.extend(m for m in scoped if m not in models)
+                last_brand = None
+            i = best_end if (hit_brands or hit_models) else i + 1
+        return Mentions(brands=tuple(brands), models=tuple(models))
+
+    def rows(self, mentions):
+        """Row positions covered by ``mentions``.
+
+        A brand that also has one of its models mentioned is narrowed to
+        those models; other brands contribute all their rows.
+        """
+        narrowed = {brand for brand, _ in mentions.models}
+        parts = [self.model_rows[m] for m in mentions.models if m in self.model_rows]
+        parts += [self.brand_rows[b] for b in mentions.brands if b not in narrowed and b in self.brand_rows]
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(parts))
+
+    def search(self, brand=None, model=None):
+        """Case-insensitive substring match over the distinct names only."""
+        brand = (brand or "").lower()
+        model = (model or "").lower()
+        if not model:
+            parts = [rows for name, rows in self.brand_rows.items() if brand in str(name).lower()]
+        else:
+            parts = [
+                rows for (b, m), rows in self.model_rows.items()
+                if brand in str(b).lower() and model in str(m).lower()
+            ]
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(parts))
+
+
+@per_frame_cache
+def get_index(frame):
+    """Return the index for ``frame``, building it on first use.
+
+    Indexes are cached per frame object and dropped when the frame is
+    garbage-collected, so a cached upload keeps its index across reruns.
+    """
+    return BrandModelIndex(frame)
@@ -0,0 +1,47 @@
+"""Per-frame memoization of derived state (indexes, valuations).
+
+Frames in the ingest registry are shared and read-only, so anything built
+from one can be cached on the frame object itself: :func:`per_frame_cache`
+keys results by ``id(frame)``, checks a weak reference so a recycled id is
+never mistaken for the old frame, and drops the entry when the frame is
+garbage-collected (lazily, on the next lookup).
+"""
+
+import functools
+import threading
+import weakref
+from collections import deque
+
+
+def per_frame_cache(builder):
+    """Wrap ``builder(frame)`` so it runs once per frame object."""
+    entries = {}
+    lock = threading.Lock()
+    dropped = deque()
+
+    def drop(key):
+        # Runs from garbage collection, possibly while this thread holds
+        # ``lock``: queue the key and let the next call remove the entry.
+        dropped.append(key)
+
+    def drain():
+        while dropped:
+            entries.pop(dropped.popleft(), None)
+
+    @functools.wraps(builder)
+    def get(frame):
+        key = id(frame)
+        with lock:
+            drain()
+            entry = entries.get(key)
+        if entry is not None and entry[0]() is frame:
+            return entry[1]
+
+        value = builder(frame)
+        with lock:
+            drain()  # an earlier frame with this id must not evict the new entry later
+            entries[key] = (weakref.ref(frame), value)
+        weakref.finalize(frame, drop, key)
+        return value
+
+    return get
@@ -0,0 +1,78 @@
+"""Column cleaning shared by every data source the app loads.
+
+Every frame goes through :func:`normalize_frame` once, right after parsing,
+and comes out with compact dtypes: categorical Brand/Model, nullable
+``Int16`` Year and ``float32`` Price/Kilometers.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+NUMERIC_COLUMNS = ("Price", "Kilometers")
+TEXT_COLUMNS = ("Brand", "Model")
+
+NUMERIC_DTYPE = np.float32
+YEAR_DTYPE = "Int16"
+DATE_FORMAT = "%m/%d/%Y"  # scraped snapshots, e.g. 04/15/2025
+
+
+def _as_arrow_strings(series):
+    try:
+        return pa.array(series, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(series.astype(str).where(series.notna()), type=pa.string(), from_pandas=True)
+
+
+def clean_numeric(series):
+    """Turn values like ``"16,769 km"`` or ``"395,000"`` into ``float32``.
+
+    Columns that are already numeric (``37000.0`` in the Dubizzle splits) are
+    only down-cast.  Text columns are parsed in one pass by Arrow's RE2
+    kernels: drop thousands separators, then take the first run of digits.
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.astype(NUMERIC_DTYPE)
+
+    text = pc.replace_substring(_as_arrow_strings(series), ",", "")
+    matched = pc.extract_regex(text, r"(?P<value>\d+)")
+    digits = pc.if_else(pc.is_valid(matched), pc.struct_field(matched, [0]), None)
+    values = pc.cast(digits, pa.float64()).to_numpy(zero_copy_only=False)
+    return pd.Series(values.astype(NUMERIC_DTYPE), index=series.index, name=series.name)
+
+
+def clean_year(series):
+    values = pd.to_numeric(series, errors="coerce")
+    return values.round().astype(YEAR_DTYPE)
+
+
+def clean_date(series):
+    """Parse ``DATE_FORMAT`` dates without per-element format inference.
+
+    Only a column where no value matches the format (e.g. ISO dates from
+    another export) falls back to pandas' inference.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    dates = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce")
+    if dates.isna().all() and series.notna().any():
+        dates = pd.to_datetime(series, errors="coerce")
+    return dates
+
+
+def normalize_frame(df):
+    """Return a cleaned copy of a raw market/showroom CSV frame."""
+    df = df.rename(columns=lambda c: str(c).lstrip("\ufeff").strip())
+
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = clean_numeric(df[col])
+    if "Year" in df.columns:
+        df["Year"] = clean_year(df["Year"])
+    for col in TEXT_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    if "Date" in df.columns:
+        df["Date"] = clean_date(df["Date"])
+    return df
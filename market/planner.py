@@ -0,0 +1,223 @@
+"""Compile a user question into a typed filter plan and execute it.
+
+:func:`parse_question` turns the free-text question into a
+:class:`QueryPlan` (mode, explicit brand/model, years, price range, km
+cap) with patterns compiled once at import and results memoized per
+question string.  :func:`plan_question` additionally resolves the brands
+and models mentioned in a "condition" question against the loaded data's
+:class:`~market.matcher.BrandModelIndex`.
+
+:func:`select_rows` is the single filter engine every mode goes through:
+it narrows by index lookups first and then applies the numeric bounds as
+boolean masks over the selected rows only, returning row positions.
+"""
+
+import re
+import threading
+import weakref
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+import numpy as np
+
+from market.matcher import Mentions, get_index
+
+REQUIRED_COLUMNS = ("Brand", "Model", "Price", "Year", "Kilometers")
+
+CONDITION = "condition"
+HISTORY_LINE = "history line"
+BRAND_MARKET = "brand market"
+OVERALL = "overall"
+
+OVERALL_KEYWORDS = (
+    'overall', 'market', 'all brands', 'general trend', 'whole market', 'total',
+    '总览', '整体', '全部', '所有', '市场', '平均',
+)
+# Questions that only want the deal ranking, answered without the LLM.  Whole
+# words only, and "rank" as a verb only with what is ranked ("rank the deals"),
+# so "Frank", "cranky" and "how do brands rank on resale?" still go to GPT.
+_RANKING_RE = re.compile(
+    r'\brankings?\b'
+    r'|\brank(?:ed)?\s+(?:the\s+)?(?:deals|listings|cars|offers)\b'
+    r'|\b(?:top|best)\s+(?:\d+\s+)?(?:deals?|offers?|value listings)\b'
+    r'|排名|排行',
+    re.IGNORECASE,
+)
+
+# Amounts are written in full ("90000", "120,000") or in thousands ("90k").
+_AMOUNT = r'(?<![\d,.])(\d{1,3}(?:,\d{3})+|\d{4,7}|\d{1,3}(?:\.\d+)?k)\b'
+_CURRENCY = r'(?:aed|dhs?|\$)'
+_UPPER_RE = re.compile(rf'(?:under|below|less than|up to|max(?:imum)?)\s*{_CURRENCY}?\s*{_AMOUNT}', re.IGNORECASE)
+_LOWER_RE = re.compile(rf'(?:over|above|more than|at least|min(?:imum)?)\s*{_CURRENCY}?\s*{_AMOUNT}', re.IGNORECASE)
+_RANGE_RE = re.compile(rf'{_AMOUNT}\s*{_CURRENCY}?\s*(?:to|-|and)\s*{_CURRENCY}?\s*{_AMOUNT}', re.IGNORECASE)
+_BARE_RE = re.compile(rf'({_CURRENCY}\s*)?{_AMOUNT}(\s*{_CURRENCY}\b)?', re.IGNORECASE)
+_YEAR_LIKE_RE = re.compile(r'(?:19|20)\d\d')
+_KM_RE = re.compile(r'(?:under|below|less than)?\s*(\d{2,3},?\d{3}|\d{2,3}k)\s*(?:km|kilometers)', re.IGNORECASE)
+_BRAND_RE = re.compile(r'brand-[\'"]?([\w\s\-]+)[\'"]?', re.IGNORECASE)
+_MODEL_RE = re.compile(r'model-[\'"]?([\w\s\-]+)[\'"]?', re.IGNORECASE)
+_YEAR_RE = re.compile(r'year-[\'"]?([\d,\s]+)[\'"]?', re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    mode: str = None
+    brand: str = None  # explicit brand-"..." filter (substring match)
+    model: str = None  # explicit model-"..." filter (substring match)
+    years: tuple = ()
+    price_min: float = None
+    price_max: float = None
+    km_max: float = None
+    rankings_only: bool = False
+    mentions: Mentions = Mentions()  # names resolved against the data (condition mode)
+
+    def cache_key(self):
+        """Plain dict identifying the filters, for :func:`market.llm_cache.make_key`."""
+        return {
+            "brand": (self.brand or "").lower(),
+            "model": (self.model or "").lower(),
+            "years": list(self.years),
+            "price_min": self.price_min,
+            "price_max": self.price_max,
+            "km_max": self.km_max,
+            "brands": sorted(self.mentions.brands),
+            "models": sorted(m for _, m in self.mentions.models),
+        }
+
+
+def detect_mode(question):
+    text = question.lower()
+    for mode in (CONDITION, HISTORY_LINE, BRAND_MARKET):
+        if mode in text:
+            return mode
+    if any(kw in text for kw in OVERALL_KEYWORDS):
+        return OVERALL
+    if _RANKING_RE.search(text):
+        return CONDITION  # "top deals for Toyota under 50000": filters as in condition mode
+    return None
+
+
+def _number(text):
+    text = text.replace(",", "").lower()
+    if text.endswith("k"):
+        return float(text[:-1]) * 1000
+    return float(text)
+
+
+def _year_like(text):
+    return _YEAR_LIKE_RE.fullmatch(text) is not None
+
+
+def _price_bounds(text):
+    """``(price_min, price_max)`` stated in ``text``.
+
+    A bare model year ("BMW 2019 under 90000") is never a price; a 19xx/20xx
+    figure only counts with a cue such as "under", "AED" or "$".
+    """
+    for match in _RANGE_RE.finditer(text):
+        low, high = match.groups()
+        if not (_year_like(low) and _year_like(high)):  # "2018-2020" is a span of years
+            return _number(low), _number(high)
+    upper = next(iter(_UPPER_RE.findall(text)), None)
+    lower = next(iter(_LOWER_RE.findall(text)), None)
+    if upper or lower:
+        return (_number(lower) if lower else None), (_number(upper) if upper else None)
+    for prefix, amount, suffix in _BARE_RE.findall(text):
+        if prefix or suffix or not _year_like(amount):
+            return _number(amount), None
+    return None, None
+
+
+@lru_cache(maxsize=1024)
+def parse_question(question):
+    """Parse ``question`` into a :class:`QueryPlan` (without data-dependent mentions)."""
+    mode = detect_mode(question)
+    fields = {"mode": mode}
+    if mode != HISTORY_LINE and _RANKING_RE.search(question):
+        fields["rankings_only"] = True
+
+    brand_match = _BRAND_RE.search(question)
+    model_match = _MODEL_RE.search(question)
+    if brand_match:
+        fields["brand"] = brand_match.group(1).strip()
+    if model_match:
+        fields["model"] = model_match.group(1).strip()
+
+    year_match = _YEAR_RE.search(question)
+    if year_match:
+        fields["years"] = tuple(sorted({int(y) for y in re.findall(r"\d+", year_match.group(1))}))
+
+    if mode == CONDITION:
+        # Mileage and year- figures are never also the price bound.
+        price_text = _YEAR_RE.sub(" ", question)
+        km_match = _KM_RE.search(price_text)
+        if km_match:
+            fields["km_max"] = _number(km_match.group(1))
+            price_text = price_text[:km_match.start(1)] + price_text[km_match.end(1):]
+        price_min, price_max = _price_bounds(price_text)
+        if price_min is not None:
+            fields["price_min"] = price_min
+        if price_max is not None:
+            fields["price_max"] = price_max
+
+    return QueryPlan(**fields)
+
+
+_resolved = weakref.WeakKeyDictionary()
+_resolved_lock = threading.Lock()
+
+
+def plan_question(question, index):
+    """Return the plan for ``question`` with mentions resolved against ``index``.
+
+    Resolved plans are memoized per index, so reruns of the same question
+    over the same data skip parsing and name resolution entirely.
+    """
+    with _resolved_lock:
+        plans = _resolved.setdefault(index, {})
+        plan = plans.get(question)
+    if plan is not None:
+        return plan
+
+    plan = parse_question(question)
+    if plan.mode == CONDITION:
+        plan = replace(plan, mentions=index.resolve(question))
+    with _resolved_lock:
+        plans[question] = plan
+    return plan
+
+
+def select_rows(frame, plan, index=None, required=REQUIRED_COLUMNS):
+    """Row positions of ``frame`` that satisfy ``plan``.
+
+    Brand/model filters are index lookups; years, price and km bounds and
+    the non-null check on ``required`` are masks over those rows only.
+    """
+    index = index or get_index(frame)
+    if plan.mentions:
+        rows = index.rows(plan.mentions)
+    elif plan.brand or plan.model:
+        rows = index.search(plan.brand, plan.model)
+    else:
+        rows = np.arange(len(frame), dtype=np.intp)
+    if not len(rows):
+        return rows
+    everything = len(rows) == len(frame)
+
+    def column(name):
+        # Unfiltered columns are read in place rather than gathered.
+        return frame[name] if everything else frame[name].take(rows)
+
+    mask = np.ones(len(rows), dtype=bool)
+    for name in required:
+        mask &= column(name).notna().to_numpy()
+    if plan.years:
+        mask &= column("Year").isin(plan.years).fillna(False).to_numpy(dtype=bool)
+    if plan.price_min or plan.price_max:
+        price = column("Price").to_numpy(dtype=np.float64, na_value=np.nan)
+        if plan.price_min:
+            mask &= price >= plan.price_min
+        if plan.price_max:
+            mask &= price <= plan.price_max
+    if plan.km_max:
+        mask &= column("Kilometers").to_numpy(dtype=np.float64, na_value=np.nan) <= plan.km_max
+    return rows[mask]
@@ -0,0 +1,165 @@
+"""Fit a data table into a prompt under a token budget.
+
+Instead of pasting ``to_csv()`` of every matching row, :func:`fit_table`
+degrades step by step until the table fits the budget:
+
+1. full rows
+2. per-group aggregates (one row per model, date, ...)
+3. a stratified sample of rows, allocated proportionally across groups
+4. a quantile table
+
+The chosen level is returned so the UI can tell the user how much the data
+was compressed.
+"""
+
+import math
+import os
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER", "o200k_base")  # gpt-4o
+
+LEVEL_FULL = "full rows"
+LEVEL_AGGREGATES = "aggregates"
+LEVEL_SAMPLE = "stratified sample"
+LEVEL_QUANTILES = "quantile table"
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+STAT_COLUMNS = ("Price", "Year", "Kilometers")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None and not _encoding_failed:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception:
+                # No tiktoken, or its BPE file cannot be fetched: estimate instead.
+                _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # CSV-heavy text averages a little under 4 characters per token.
+    return math.ceil(len(text) / 3.5)
+
+
+@dataclass(frozen=True)
+class PromptTable:
+    text: str
+    level: str
+    tokens: int
+    rows_in: int
+    rows_out: int
+
+    def describe(self):
+        if self.level == LEVEL_FULL:
+            return f"{self.level} ({self.rows_in} rows, ~{self.tokens} tokens)"
+        return f"{self.level} ({self.rows_out} rows from {self.rows_in}, ~{self.tokens} tokens)"
+
+
+def _stats_columns(df):
+    return [c for c in STAT_COLUMNS if c in df.columns]
+
+
+def _as_float64(df):
+    stats = _stats_columns(df)
+    return df.astype({c: "float64" for c in stats}), stats
+
+
+def aggregate_table(df, group_by):
+    df, stats = _as_float64(df)
+    agg = {"Count": (stats[0], "size")} if stats else {}
+    for col in stats:
+        agg[f"Median {col}"] = (col, "median")
+    if "Price" in stats:
+        agg["Min Price"] = ("Price", "min")
+        agg["Max Price"] = ("Price", "max")
+    return df.groupby(list(group_by), observed=True).agg(**agg).reset_index()
+
+
+def stratified_sample(df, group_by, n, seed=0):
+    """Up to ``n`` rows spread across ``group_by`` strata in proportion to size (at least one each)."""
+    if n >= len(df):
+        return df
+    shuffled = df.sample(frac=1.0, random_state=seed)
+    keys = [shuffled[c] for c in group_by]
+    sizes = shuffled.groupby(keys, observed=True, sort=False)[shuffled.columns[0]].transform("size")
+    quota = np.maximum(1, np.floor(sizes.to_numpy() * n / len(df)))
+    rank = shuffled.groupby(keys, observed=True, sort=False).cumcount().to_numpy()
+    return shuffled[rank < quota].sort_index()
+
+
+def quantile_table(df, group_by=()):
+    df, stats = _as_float64(df)
+    if group_by:
+        grouped = df.groupby(list(group_by), observed=True)[stats].quantile(list(QUANTILES))
+        table = grouped.unstack()
+        table.columns = [f"{col} p{int(q * 100)}" for col, q in table.columns]
+        return table.reset_index()
+    table = df[stats].quantile(list(QUANTILES))
+    table.index = [f"p{int(q * 100)}" for q in table.index]
+    return table.rename_axis("Quantile").reset_index()
+
+
+def fit_table(df, group_by=("Brand", "Model"), budget=DEFAULT_TOKEN_BUDGET):
+    """Serialize ``df`` as CSV at the most detailed level that fits ``budget`` tokens."""
+    group_by = [c for c in group_by if c in df.columns]
+
+    def attempt(level, table):
+        # Every numeric column here is a whole number (AED, km, year, count).
+        text = table.to_csv(index=False, float_format="%.0f")
+        return PromptTable(text, level, count_tokens(text), len(df), len(table))
+
+    if df.empty:
+        return attempt(LEVEL_FULL, df)
+
+    # Estimate the full table from a head sample; only serialize every row
+    # when that estimate fits, since tokenizing a large table is costly.
+    sample_rows = min(len(df), 50)
+    tokens_per_row = max(count_tokens(df.head(sample_rows).to_csv(index=False, float_format="%.0f")) / sample_rows, 1.0)
+    if tokens_per_row * len(df) <= budget:
+        result = attempt(LEVEL_FULL, df)
+        if result.tokens <= budget:
+            return result
+
+    if group_by:
+        result = attempt(f"{LEVEL_AGGREGATES} by {', '.join(group_by)}", aggregate_table(df, group_by))
+        if result.tokens <= budget:
+            return result
+
+        # Coarser strata (e.g. Brand instead of Brand+Model) once there are
+        # more groups than rows we can afford.
+        strata_levels = [group_by[:k] for k in range(len(group_by), 0, -1)]
+        group_counts = {len(s): df.groupby(s, observed=True).ngroups for s in strata_levels}
+
+        n = int(budget / tokens_per_row)
+        for strata in strata_levels:
+            if group_counts[len(strata)] > n:
+                continue
+            while n >= group_counts[len(strata)]:
+                result = attempt(LEVEL_SAMPLE, stratified_sample(df, strata, n))
+                if result.tokens <= budget:
+                    return result
+                n = int(n * 0.8)
+
+        for strata in strata_levels:
+            result = attempt(f"{LEVEL_QUANTILES} by {', '.join(strata)}", quantile_table(df, strata))
+            if result.tokens <= budget:
+                return result
+
+    return attempt(LEVEL_QUANTILES, quantile_table(df))
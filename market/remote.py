@@ -0,0 +1,221 @@
+"""Remote dataset loader for the "Load from GitHub" source.
+
+Downloads are cached on disk under ``REMOTE_CACHE_DIR`` together with the
+response's ``ETag`` / ``Last-Modified``.  Within ``REMOTE_REVALIDATE_SECONDS``
+the cached body is used without touching the network; after that the URL
+is revalidated with ``If-None-Match`` / ``If-Modified-Since`` and a ``304``
+reuses the cached body.  Bodies are streamed to disk in chunks, hashed on
+the way, and rejected once they exceed ``REMOTE_MAX_MB``.
+
+The cached file is then parsed in row chunks straight through
+:func:`~market.normalize.normalize_frame`, so the raw text of a large file
+is never held in memory as one object.  Plain, gzip- and zstd-compressed
+CSV and Parquet are supported; the parsed frame is registered once in the
+ingest :class:`~market.ingest.FrameCache` keyed by the body's hash and
+leased to every session that loads the same body.
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from urllib.error import HTTPError
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from market.ingest import IngestedFile, get_frame_cache
+from market.normalize import TEXT_COLUMNS, normalize_frame
+
+DEFAULT_CACHE_DIR = os.getenv("REMOTE_CACHE_DIR", os.path.join("data", "remote_cache"))
+DEFAULT_MAX_BYTES = int(os.getenv("REMOTE_MAX_MB", "200")) * 1024 * 1024
+DEFAULT_REVALIDATE_SECONDS = float(os.getenv("REMOTE_REVALIDATE_SECONDS", "300"))
+DEFAULT_TIMEOUT = float(os.getenv("REMOTE_TIMEOUT", "30"))
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+PARSE_CHUNK_ROWS = int(os.getenv("REMOTE_CHUNK_ROWS", "200000"))
+
+_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"PAR1": "parquet",
+}
+
+
+class RemoteDataTooLarge(ValueError):
+    pass
+
+
+def detect_format(path, url=""):
+    """``"csv"``, ``"gzip"``, ``"zstd"`` or ``"parquet"``, from magic bytes, else the URL."""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    for magic, fmt in _MAGIC.items():
+        if head.startswith(magic):
+            return fmt
+    suffix = urllib.parse.urlparse(url).path.lower()
+    for ext, fmt in ((".parquet", "parquet"), (".gz", "gzip"), (".zst", "zstd")):
+        if suffix.endswith(ext):
+            return fmt
+    return "csv"
+
+
+def _finish_frame(chunks):
+    if not chunks:
+        return pd.DataFrame()
+    frame = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    # Chunks carry their own categories; unify them once at the end.
+    for col in TEXT_COLUMNS:
+        if col in frame.columns and not isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = frame[col].astype("category")
+    return frame
+
+
+def parse_file(path, url="", chunk_rows=PARSE_CHUNK_ROWS):
+    """Parse a cached download into one normalized frame, ``chunk_rows`` at a time."""
+    fmt = detect_format(path, url)
+    if fmt == "parquet":
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_rows)
+        return _finish_frame([normalize_frame(b.to_pandas()) for b in batches])
+
+    source = pa.OSFile(path, "rb")
+    if fmt in ("gzip", "zstd"):
+        source = pa.CompressedInputStream(source, fmt)
+    with source:
+        reader = pd.read_csv(source, encoding="utf-8-sig", chunksize=chunk_rows)
+        return _finish_frame([normalize_frame(chunk) for chunk in reader])
+
+
+class RemoteCache:
+    """On-disk cache of downloaded bodies plus their validators."""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 revalidate_seconds=DEFAULT_REVALIDATE_SECONDS, timeout=DEFAULT_TIMEOUT):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.timeout = timeout
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, f"{key}.body"), os.path.join(self.root, f"{key}.json")
+
+    def _lock(self, url):
+        with self._locks_guard:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def fetch(self, url, progress=None):
+        """Return ``(body_path, meta)`` for ``url``, downloading only when it changed.
+
+        ``progress(done_bytes, total_bytes_or_None)`` is called while a body
+        is being downloaded.
+        """
+        body_path, meta_path = self._paths(url)
+        with self._lock(url):
+            meta = None
+            if os.path.exists(body_path) and os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                if time.time() - meta["checked_at"] < self.revalidate_seconds:
+                    return body_path, dict(meta, status="fresh")
+
+            request = urllib.request.Request(url)
+            if meta is not None:
+                if meta.get("etag"):
+                    request.add_header("If-None-Match", meta["etag"])
+                if meta.get("last_modified"):
+                    request.add_header("If-Modified-Since", meta["last_modified"])
+            try:
+                response = urllib.request.urlopen(request, timeout=self.timeout)
+            except HTTPError as error:
+                if error.code == 304 and meta is not None:
+                    meta["checked_at"] = time.time()
+                    self._write_meta(meta_path, meta)
+                    return body_path, dict(meta, status="not modified")
+                raise
+
+            with response:
+                meta = self._download(response, body_path, progress)
+            meta["url"] = url
+            self._write_meta(meta_path, meta)
+            return body_path, dict(meta, status="downloaded")
+
+    def _download(self, response, body_path, progress):
+        total = response.headers.get("Content-Length")
+        total = int(total) if total and total.isdigit() else None
+        if total is not None and total > self.max_bytes:
+            raise RemoteDataTooLarge(f"remote file is {total / 2 ** 20:.1f} MB, limit is {self.max_bytes / 2 ** 20:.1f} MB")
+
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.blake2b(digest_size=16)
+        done = 0
+        tmp = f"{body_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as out:
+                while True:
+                    chunk = response.read(DOWNLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    done += len(chunk)
+                    if done > self.max_bytes:
+                        raise RemoteDataTooLarge(f"remote file exceeds the {self.max_bytes / 2 ** 20:.1f} MB limit")
+                    digest.update(chunk)
+                    out.write(chunk)
+                    if progress is not None:
+                        progress(done, total)
+            os.replace(tmp, body_path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified") or email.utils.formatdate(usegmt=True),
+            "digest": digest.hexdigest(),
+            "bytes": done,
+            "checked_at": time.time(),
+        }
+
+    @staticmethod
+    def _write_meta(meta_path, meta):
+        tmp = f"{meta_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+
+def load_remote(url, progress=None, cache=None, frames=None):
+    """Fetch ``url`` through the disk cache and return it as an :class:`IngestedFile`."""
+    cache = cache or get_remote_cache()
+    frames = frames or get_frame_cache()
+    parsed = urllib.parse.urlparse(url)
+    name = os.path.basename(parsed.path) or url
+    if parsed.scheme in ("http", "https"):
+        body_path, meta = cache.fetch(url, progress=progress)
+    else:
+        # Local paths and file:// URLs are read in place, keyed by their stat.
+        body_path = urllib.request.url2pathname(parsed.path) if parsed.scheme == "file" else url
+        stat = os.stat(body_path)
+        key = f"{os.path.abspath(body_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        meta = {"digest": hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest(),
+                "bytes": stat.st_size, "status": "local"}
+    lease = frames.acquire(meta["digest"], lambda: parse_file(body_path, url))
+    return IngestedFile(name=name, digest=meta["digest"], frame=lease.frame, lease=lease), meta
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_remote_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = RemoteCache()
+    return _default_cache
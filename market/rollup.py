@@ -0,0 +1,193 @@
+"""Pre-aggregated (Brand, Model, Year, Date) rollup behind the history trend.
+
+Every dated snapshot adds two small Arrow files under ``<store>/_rollup``:
+
+* ``stats-<digest>.arrow``: count, sum, min and max of Price and
+  Kilometers per (Brand, Model, Year, Date);
+* ``sketch-<digest>.arrow``: a log-bucketed quantile sketch (DDSketch
+  style) of the same values, stored as ``(key..., Metric, Bucket, Count)``.
+
+Both are mergeable by plain summation, so adding a snapshot never touches
+existing files, and a trend query only merges the rows of the requested
+model instead of re-scanning every listing.  Sketch quantiles are within
+``RELATIVE_ACCURACY`` of the exact value.
+
+The rollup serves the per-day trend (the "daily snapshots" history view);
+listing-level uses of the history, such as chart points and deduplication,
+still read the stored snapshots.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from market.arrow_io import read_ipc, to_ipc_table, write_ipc
+from market.tracing import span
+
+KEY_COLUMNS = ["Brand", "Model", "Year", "Date"]
+METRICS = ("Price", "Kilometers")
+
+RELATIVE_ACCURACY = 0.005
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = np.log(_GAMMA)
+ZERO_BUCKET = -1  # values below 1 (e.g. brand-new cars with 0 km)
+
+_KEY_SCHEMA = [
+    ("Brand", pa.dictionary(pa.int32(), pa.string())),
+    ("Model", pa.dictionary(pa.int32(), pa.string())),
+    ("Year", pa.int16()),
+    ("Date", pa.timestamp("ns")),
+]
+STATS_SCHEMA = pa.schema(_KEY_SCHEMA + [
+    ("Count", pa.int32()),
+    *[(f"{m}{stat}", pa.float64()) for m in METRICS for stat in ("Count", "Sum", "Min", "Max")],
+])
+SKETCH_SCHEMA = pa.schema(_KEY_SCHEMA + [
+    ("Metric", pa.dictionary(pa.int8(), pa.string())),
+    ("Bucket", pa.int16()),
+    ("Count", pa.int32()),
+])
+
+
+def bucket_of(values):
+    values = np.asarray(values, dtype=np.float64)
+    buckets = np.full(values.shape, ZERO_BUCKET, dtype=np.int16)
+    positive = values >= 1
+    buckets[positive] = np.ceil(np.log(values[positive]) / _LOG_GAMMA).astype(np.int16)
+    return buckets
+
+
+def bucket_value(buckets):
+    buckets = np.asarray(buckets, dtype=np.float64)
+    values = 2 * _GAMMA ** buckets / (_GAMMA + 1)
+    return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+
+def summarize(frame):
+    """Return ``(stats, sketch)`` frames for one snapshot's normalized rows."""
+    rows = frame[[c for c in KEY_COLUMNS + list(METRICS) if c in frame.columns]]
+    rows = rows[rows["Brand"].notna() & rows["Model"].notna() & rows["Date"].notna()]
+    rows = rows.assign(Date=rows["Date"].dt.normalize())
+    grouped = rows.groupby(KEY_COLUMNS, observed=True, dropna=False, sort=False)
+
+    agg = {"Count": ("Brand", "size")}
+    for metric in METRICS:
+        agg[f"{metric}Count"] = (metric, "count")
+        agg[f"{metric}Sum"] = (metric, "sum")
+        agg[f"{metric}Min"] = (metric, "min")
+        agg[f"{metric}Max"] = (metric, "max")
+    stats = grouped.agg(**agg).reset_index()
+
+    sketches = []
+    for metric in METRICS:
+        valued = rows[rows[metric].notna()]
+        buckets = valued[KEY_COLUMNS].assign(Bucket=bucket_of(valued[metric]))
+        counts = buckets.groupby(KEY_COLUMNS + ["Bucket"], observed=True, dropna=False, sort=False).size()
+        sketches.append(counts.rename("Count").reset_index().assign(Metric=metric))
+    sketch = pd.concat(sketches, ignore_index=True)
+    return stats, sketch
+
+
+def sketch_quantiles(sketch, by, quantiles=(0.5,)):
+    """Merge sketch rows per ``by`` group and read off the given quantiles.
+
+    Like ``Series.quantile`` the value at a fractional rank is interpolated
+    between its two neighbouring order statistics.
+    """
+    merged = sketch.groupby(by + ["Bucket"], observed=True, sort=True)["Count"].sum().reset_index()
+    grouped = merged.groupby(by, observed=True, sort=False)["Count"]
+    cumulative = grouped.cumsum().to_numpy()
+    total = grouped.transform("sum").to_numpy()
+    first = ~merged.duplicated(by).to_numpy()
+
+    result = merged.loc[first, by].reset_index(drop=True)
+    result_keys = pd.MultiIndex.from_frame(result[by])
+    group_total = total[first]
+
+    def value_at(rank):
+        # First bucket whose cumulative count passes the 0-based rank.
+        hit = merged[cumulative > rank].groupby(by, observed=True, sort=False).head(1)
+        values = pd.Series(bucket_value(hit["Bucket"].to_numpy()), index=pd.MultiIndex.from_frame(hit[by]))
+        return values.reindex(result_keys).to_numpy()
+
+    for q in quantiles:
+        rank = q * (total - 1)
+        lower, upper = value_at(np.floor(rank)), value_at(np.ceil(rank))
+        frac = q * (group_total - 1) % 1
+        result[f"q{int(round(q * 100))}"] = lower + (upper - lower) * frac
+    return result
+
+
+class TrendRollup:
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, kind, digest):
+        return os.path.join(self.root, f"{kind}-{digest}.arrow")
+
+    def has_source(self, digest):
+        return os.path.exists(self._path("sketch", digest))
+
+    def sources(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(n[len("sketch-"):-len(".arrow")] for n in os.listdir(self.root)
+                      if n.startswith("sketch-") and n.endswith(".arrow"))
+
+    def add_snapshot(self, frame, digest):
+        """Fold one snapshot into the rollup; a source already folded in is skipped."""
+        if self.has_source(digest):
+            return False
+        stats, sketch = summarize(frame)
+        write_ipc(to_ipc_table(stats, STATS_SCHEMA), self._path("stats", digest))
+        # The sketch file is written last: its presence marks the source as done.
+        write_ipc(to_ipc_table(sketch, SKETCH_SCHEMA), self._path("sketch", digest))
+        return True
+
+    def _read(self, kind, where):
+        tables = []
+        for digest in self.sources():
+            table = read_ipc(self._path(kind, digest))
+            tables.append(table.filter(where) if where is not None else table)
+        schema = STATS_SCHEMA if kind == "stats" else SKETCH_SCHEMA
+        if not tables:
+            return schema.empty_table().to_pandas()
+        return pa.concat_tables(tables).to_pandas(types_mapper={pa.int16(): pd.Int16Dtype()}.get)
+
+    def trend(self, where=None, quantiles=(0.5,)):
+        """Per-date trend for the rows matching ``where`` (a ``pyarrow.compute`` expression).
+
+        Returns one row per Date with the listing count, mean Kilometers,
+        mean Year and the requested Price quantiles (``MedianPrice`` for 0.5).
+        """
+        with span("rollup_trend") as s:
+            trend = self._trend(where, quantiles)
+            s.rows_in = int(trend["Count"].sum()) if len(trend) else 0
+            s.rows_out = len(trend)
+        return trend
+
+    def _trend(self, where, quantiles):
+        stats = self._read("stats", where)
+        sketch = self._read("sketch", where)
+        if stats.empty:
+            return pd.DataFrame(columns=["Date", "Count", "MedianPrice", "Kilometers", "Year"])
+
+        stats = stats.assign(YearSum=stats["Year"].astype("float64") * stats["Count"],
+                             YearCount=stats["Count"].where(stats["Year"].notna(), 0))
+        daily = stats.groupby("Date", sort=True).agg(
+            Count=("Count", "sum"),
+            KilometersSum=("KilometersSum", "sum"),
+            KilometersCount=("KilometersCount", "sum"),
+            YearSum=("YearSum", "sum"),
+            YearCount=("YearCount", "sum"),
+        ).reset_index()
+        daily["Kilometers"] = daily["KilometersSum"] / daily["KilometersCount"].replace(0, np.nan)
+        daily["Year"] = daily["YearSum"] / daily["YearCount"].replace(0, np.nan)
+
+        prices = sketch_quantiles(sketch[sketch["Metric"] == "Price"], ["Date"], quantiles)
+        prices = prices.rename(columns={"q50": "MedianPrice"})
+        trend = daily[["Date", "Count", "Kilometers", "Year"]].merge(prices, on="Date", how="left")
+        return trend[["Date", "Count"] + [c for c in prices.columns if c != "Date"] + ["Kilometers", "Year"]]
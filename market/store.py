@@ -0,0 +1,200 @@
+"""On-disk store of dated market snapshots.
+
+Each snapshot date is a hive-style partition directory (``Date=YYYY-MM-DD``)
+holding one uncompressed Arrow IPC file per source upload, so files can be
+memory-mapped and only the buffers of the columns a query touches are paged
+in.  Appending a new day writes a new file and never rewrites existing ones.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from market.arrow_io import read_ipc, to_ipc_table, write_ipc
+from market.rollup import TrendRollup
+from market.tracing import span
+
+DEFAULT_STORE_DIR = os.getenv("SNAPSHOT_STORE_DIR", os.path.join("data", "snapshots"))
+
+# Date lives in the partition path, not in the files themselves.
+# Types mirror market.normalize so a stored snapshot reads back with the same
+# compact pandas dtypes it was written from.
+STORE_SCHEMA = pa.schema([
+    ("Brand", pa.dictionary(pa.int32(), pa.string())),
+    ("Model", pa.dictionary(pa.int32(), pa.string())),
+    ("Title", pa.string()),
+    ("Price", pa.float32()),
+    ("Year", pa.int16()),
+    ("Kilometers", pa.float32()),
+])
+
+PARTITION_PREFIX = "Date="
+
+
+def _partition_name(day):
+    return f"{PARTITION_PREFIX}{pd.Timestamp(day):%Y-%m-%d}"
+
+
+class SnapshotStore:
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        self.rollup = TrendRollup(os.path.join(root, "_rollup"))
+        self._known_sources = set()
+        self._rollup_checked = False
+        self._rollup_lock = threading.Lock()
+
+    # ---- write path -------------------------------------------------------
+
+    def sources(self):
+        found = set()
+        for part in self._partitions():
+            for name in os.listdir(os.path.join(self.root, part)):
+                if name.startswith("part-") and name.endswith(".arrow"):
+                    found.add(name[len("part-"):-len(".arrow")])
+        return sorted(found)
+
+    def has_source(self, digest):
+        if digest in self._known_sources:
+            return True
+        suffix = f"part-{digest}.arrow"
+        if any(os.path.exists(os.path.join(self.root, p, suffix)) for p in self._partitions()):
+            self._known_sources.add(digest)
+            return True
+        return False
+
+    def append(self, frame, digest):
+        """Store each dated slice of ``frame`` under its own partition.
+
+        ``digest`` identifies the source (e.g. the upload's content hash); a
+        source that was already appended is skipped, which keeps repeated
+        reruns idempotent.  Returns the dates that were written.
+        """
+        if "Date" not in frame.columns:
+            raise ValueError("snapshot frame has no 'Date' column")
+
+        written = []
+        with span("store_append", rows_in=len(frame)) as s:
+            dated = frame[frame["Date"].notna()]
+            for day, rows in dated.groupby(dated["Date"].dt.normalize(), sort=True):
+                part_dir = os.path.join(self.root, _partition_name(day))
+                path = os.path.join(part_dir, f"part-{digest}.arrow")
+                if os.path.exists(path):
+                    continue
+                write_ipc(to_ipc_table(rows, STORE_SCHEMA), path)
+                written.append(pd.Timestamp(day))
+            self.rollup.add_snapshot(dated, digest)
+            s.rows_out = len(dated)
+        self._known_sources.add(digest)
+        return written
+
+    def ensure_rollup(self):
+        """Fold any stored source that predates the rollup into it.
+
+        :meth:`append` folds every new source in as it is written, so only
+        stores written before the rollup existed are missing any; the
+        partitions are scanned for them once per store object, not on every
+        trend query.
+        """
+        if self._rollup_checked:
+            return 0
+        with self._rollup_lock:
+            if self._rollup_checked:
+                return 0
+            missing = self._backfill_rollup()
+            self._rollup_checked = True
+        return missing
+
+    def _backfill_rollup(self):
+        missing = set(self.sources()) - set(self.rollup.sources())
+        for digest in sorted(missing):
+            tables = []
+            for part in self._partitions():
+                path = os.path.join(self.root, part, f"part-{digest}.arrow")
+                if os.path.exists(path):
+                    table = read_ipc(path).cast(STORE_SCHEMA)
+                    day = pd.Timestamp(part[len(PARTITION_PREFIX):]).to_datetime64()
+                    dates = pa.array(np.full(table.num_rows, day), pa.timestamp("ns"))
+                    tables.append(table.append_column("Date", dates))
+            frame = pa.concat_tables(tables).to_pandas(types_mapper={pa.int16(): pd.Int16Dtype()}.get)
+            self.rollup.add_snapshot(frame, digest)
+        return len(missing)
+
+    # ---- read path --------------------------------------------------------
+
+    def _partitions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(p for p in os.listdir(self.root) if p.startswith(PARTITION_PREFIX))
+
+    def dates(self):
+        return [pd.Timestamp(p[len(PARTITION_PREFIX):]) for p in self._partitions()]
+
+    def __len__(self):
+        return len(self._partitions())
+
+    def read_table(self, columns=None, start=None, end=None, where=None):
+        """Read matching partitions as one Arrow table with a ``Date`` column.
+
+        Partitions outside ``[start, end]`` are never opened, files are
+        memory-mapped, and ``where`` (a ``pyarrow.compute`` expression) is
+        evaluated before projecting down to ``columns``.
+        """
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        wanted = [c for c in (columns or STORE_SCHEMA.names) if c != "Date"]
+        projected = pa.schema([STORE_SCHEMA.field(c) for c in wanted])
+
+        tables = []
+        for part in self._partitions():
+            day = pd.Timestamp(part[len(PARTITION_PREFIX):])
+            if (start is not None and day < start) or (end is not None and day > end):
+                continue
+            part_dir = os.path.join(self.root, part)
+            for name in sorted(os.listdir(part_dir)):
+                if not (name.startswith("part-") and name.endswith(".arrow")):
+                    continue
+                table = read_ipc(os.path.join(part_dir, name))
+                if where is not None:
+                    table = table.filter(where)
+                table = table.select(wanted).cast(projected)
+                dates = pa.array(np.full(table.num_rows, day.to_datetime64()), pa.timestamp("ns"))
+                tables.append(table.append_column("Date", dates))
+
+        if not tables:
+            return projected.append(pa.field("Date", pa.timestamp("ns"))).empty_table()
+        return pa.concat_tables(tables)
+
+    def read(self, columns=None, start=None, end=None, where=None):
+        with span("store_read") as s:
+            table = self.read_table(columns=columns, start=start, end=end, where=where)
+            frame = table.to_pandas(types_mapper={pa.int16(): pd.Int16Dtype()}.get)
+            s.rows_out = len(frame)
+        return frame
+
+
+def contains_filter(brand=None, model=None, years=None):
+    """Case-insensitive substring match on Brand/Model plus an optional year set."""
+    expr = None
+    for column, needle in (("Brand", brand), ("Model", model)):
+        if needle:
+            term = pc.match_substring(pc.field(column).cast(pa.string()), needle, ignore_case=True)
+            expr = term if expr is None else expr & term
+    if years:
+        term = pc.field("Year").isin([int(y) for y in years])
+        expr = term if expr is None else expr & term
+    return expr
+
+
+_default_store = None
+
+
+def get_snapshot_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = SnapshotStore()
+    return _default_store
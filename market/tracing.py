@@ -0,0 +1,232 @@
+"""Lightweight per-stage tracing for analysis runs.
+
+A :class:`Trace` covers one script run (or one batch question).  Code
+anywhere below it opens :func:`span` blocks, which record wall time, rows
+in and out, token counts and the RSS delta of that stage; a span opened
+with no active trace is timed but not kept.  :func:`finish_trace` appends
+every span as one JSON line to a size-rotated log (``TRACE_LOG_PATH``) and
+keeps the trace in memory so the admin sidebar can show the latest run and
+p50/p95 per stage::
+
+    trace = begin_trace(user="admin")
+    with span("filter", rows_in=len(frame)) as s:
+        rows = select_rows(frame, plan)
+        s.rows_out = len(rows)
+    finish_trace(trace, mode="condition")
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+DEFAULT_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join("data", "traces.jsonl"))
+DEFAULT_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MB", "10")) * 1024 * 1024
+DEFAULT_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "5"))
+RECENT_TRACES = int(os.getenv("TRACE_RECENT", "200"))
+
+_current = contextvars.ContextVar("market_trace", default=None)
+
+
+def rss_mb():
+    """Resident set size of this process in MiB (Linux; NaN elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+class Span:
+
+    __slots__ = ("name", "started", "seconds", "rows_in", "rows_out",
+                 "prompt_tokens", "completion_tokens", "rss_delta_mb", "attrs")
+
+    def __init__(self, name, rows_in=None, **attrs):
+        self.name = name
+        self.started = time.time()
+        self.seconds = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.rss_delta_mb = None
+        self.attrs = attrs
+
+    def to_dict(self):
+        record = {
+            "stage": self.name,
+            "started": round(self.started, 3),
+            "seconds": round(self.seconds, 6) if self.seconds is not None else None,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "rss_delta_mb": round(self.rss_delta_mb, 2) if self.rss_delta_mb is not None else None,
+        }
+        record.update(self.attrs)
+        return record
+
+
+class Trace:
+
+    def __init__(self, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.time()
+        self.attrs = attrs
+        self.spans = []
+        self.seconds = None
+        self._rss = rss_mb()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.seconds is not None
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def records(self):
+        base = {"trace_id": self.trace_id, **self.attrs}
+        return [dict(base, **s.to_dict()) for s in self.spans]
+
+    def frame(self):
+        columns = ["stage", "seconds", "rows_in", "rows_out", "prompt_tokens", "completion_tokens", "rss_delta_mb"]
+        return pd.DataFrame([s.to_dict() for s in self.spans], columns=columns)
+
+
+def current_trace():
+    return _current.get()
+
+
+def begin_trace(**attrs):
+    """Start a trace and make it current for this thread/context."""
+    trace = Trace(**attrs)
+    _current.set(trace)
+    return trace
+
+
+@contextmanager
+def activate(trace):
+    """Make ``trace`` current inside the block (e.g. on a worker thread)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, rows_in=None, **attrs):
+    """Time a stage; set ``rows_out`` / token counts on the yielded span."""
+    s = Span(name, rows_in=rows_in, **attrs)
+    trace = _current.get()
+    rss = rss_mb()
+    started = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.seconds = time.perf_counter() - started
+        s.rss_delta_mb = rss_mb() - rss
+        if trace is not None:
+            trace.add(s)
+
+
+class TraceLog:
+    """Recent traces in memory plus a size-rotated JSONL file of their spans."""
+
+    def __init__(self, path=DEFAULT_LOG_PATH, max_bytes=DEFAULT_LOG_MAX_BYTES,
+                 backups=DEFAULT_LOG_BACKUPS, recent=RECENT_TRACES):
+        self.path = path
+        self.recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+        self._logger = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"market.tracing.{id(self)}")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(handler)
+
+    def record(self, trace):
+        with self._lock:
+            self.recent.append(trace)
+        if self._logger is not None:
+            for record in trace.records():
+                self._logger.info(json.dumps(record, default=str, ensure_ascii=False))
+
+    def last(self, **attrs):
+        """Most recent trace whose attributes match ``attrs``."""
+        with self._lock:
+            traces = list(self.recent)
+        for trace in reversed(traces):
+            if all(trace.attrs.get(k) == v for k, v in attrs.items()):
+                return trace
+        return None
+
+    def stage_percentiles(self, **attrs):
+        """p50/p95 seconds per stage over the recent traces matching ``attrs``."""
+        with self._lock:
+            rows = [s.to_dict() for t in self.recent for s in t.spans
+                    if all(t.attrs.get(k) == v for k, v in attrs.items())]
+        if not rows:
+            return pd.DataFrame(columns=["stage", "count", "p50", "p95"])
+        seconds = pd.DataFrame(rows).groupby("stage")["seconds"]
+        return pd.DataFrame({
+            "count": seconds.size(),
+            "p50": seconds.quantile(0.5),
+            "p95": seconds.quantile(0.95),
+        }).reset_index().sort_values("p95", ascending=False)
+
+
+def finish_trace(trace, log=None, **attrs):
+    """Close ``trace`` (idempotent), log its spans and keep it for the sidebar.
+
+    A trace with no spans is closed but not logged.
+    """
+    if trace is None or trace.finished:
+        return trace
+    trace.attrs.update(attrs)
+    trace.seconds = time.time() - trace.started
+    if _current.get() is trace:
+        _current.set(None)
+    if not trace.spans:
+        return trace  # nothing ran: not worth a log line
+    with trace._lock:
+        trace.spans.insert(0, _total_span(trace))
+    (log or get_trace_log()).record(trace)
+    return trace
+
+
+def _total_span(trace):
+    total = Span("total")
+    total.started = trace.started
+    total.seconds = trace.seconds
+    total.prompt_tokens = sum(s.prompt_tokens or 0 for s in trace.spans) or None
+    total.completion_tokens = sum(s.completion_tokens or 0 for s in trace.spans) or None
+    total.rss_delta_mb = rss_mb() - trace._rss
+    return total
+
+
+_default_log = None
+_default_lock = threading.Lock()
+
+
+def get_trace_log():
+    global _default_log
+    with _default_lock:
+        if _default_log is None:
+            _default_log = TraceLog()
+    return _default_log
@@ -0,0 +1,219 @@
+"""In-process valuation: depreciation curves and deal scores.
+
+For every (Brand, Model) the log asking price is regressed on the car's
+age and ``log1p`` of its mileage::
+
+    log(Price) ~ a + b * Age + c * log1p(Kilometers)
+
+All groups are fitted at once: the per-group normal equations are built
+with ``np.bincount`` over the group codes and solved as one batched
+``np.linalg.solve``.  A model with too few listings (or a single model
+year) is valued with its brand's curve instead, and a brand with too few
+with the whole market's.
+
+Each listing's residual against its curve gives a ``DealScore`` (percent
+below the expected price, so higher is a better deal), its percentile
+among listings of the same model, and an ``Outlier`` flag for residuals
+more than ``OUTLIER_Z`` robust standard deviations out, which are mostly
+typos, monthly-payment prices or damaged cars rather than real bargains.
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from market.dedup import fingerprint
+from market.memo import per_frame_cache
+from market.tracing import span
+
+MIN_FIT_ROWS = int(os.getenv("VALUATION_MIN_ROWS", "8"))
+OUTLIER_Z = float(os.getenv("VALUATION_OUTLIER_Z", "3.5"))
+RIDGE = 1e-3  # keeps near-singular groups (little mileage spread) solvable
+MIN_AGE_VARIANCE = 0.25  # years²; below this the age slope is not identifiable
+REFERENCE_KM = 60000  # mileage at which the per-10k-km effect is quoted
+
+LEVELS = ("model", "brand", "market")
+RANKING_COLUMNS = ["Brand", "Model", "Title", "Year", "Kilometers", "Price", "Expected", "DealScore", "Percentile"]
+CURVE_COLUMNS = ["Brand", "Model", "Listings", "Fit", "Annual Depreciation %", "Per 10k km %", "Typical Price"]
+
+
+def _design(frame):
+    """Rows that can be valued and their ``(age, log km, log price)`` columns."""
+    price = frame["Price"].to_numpy(dtype=np.float64, na_value=np.nan)
+    year = frame["Year"].to_numpy(dtype=np.float64, na_value=np.nan)
+    km = frame["Kilometers"].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = (price > 0) & ~np.isnan(year) & (km >= 0)
+    valid &= frame["Brand"].notna().to_numpy() & frame["Model"].notna().to_numpy()
+    positions = np.flatnonzero(valid)
+    reference_year = year[valid].max() if len(positions) else 0.0
+    age = reference_year - year[positions]
+    return positions, age, np.log1p(km[positions]), np.log(price[positions])
+
+
+def fit_groups(codes, n_groups, age, log_km, log_price):
+    """Least-squares coefficients ``(a, b, c)`` per group, plus row counts and fit flags.
+
+    Returns ``(coef, counts, usable)`` with ``coef`` of shape ``(n_groups, 3)``.
+    """
+    X = np.column_stack([np.ones_like(age), age, log_km])
+    xtx = np.empty((n_groups, 3, 3))
+    for i in range(3):
+        for j in range(i, 3):
+            xtx[:, i, j] = xtx[:, j, i] = np.bincount(codes, weights=X[:, i] * X[:, j], minlength=n_groups)
+    xty = np.stack([np.bincount(codes, weights=X[:, i] * log_price, minlength=n_groups) for i in range(3)], axis=1)
+    counts = xtx[:, 0, 0]
+
+    # Slopes only are shrunk, scaled by group size, so the intercept stays the group's own level.
+    penalty = np.zeros((n_groups, 3, 3))
+    penalty[:, 1, 1] = penalty[:, 2, 2] = RIDGE * np.maximum(counts, 1.0)
+    penalty[:, 0, 0] = np.where(counts > 0, 0.0, 1.0)  # empty groups: keep the system invertible
+    coef = np.linalg.solve(xtx + penalty, xty[:, :, None])[:, :, 0]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_age = xtx[:, 0, 1] / counts
+        age_variance = xtx[:, 1, 1] / counts - mean_age ** 2
+    usable = (counts >= MIN_FIT_ROWS) & (age_variance >= MIN_AGE_VARIANCE)
+    return coef, counts, usable
+
+
+@dataclass
+class Valuation:
+    """Per-listing valuation aligned to row positions of the frame it was built from."""
+
+    expected: np.ndarray  # NaN where the row could not be valued
+    deal_score: np.ndarray
+    percentile: np.ndarray
+    outlier: np.ndarray
+    level: np.ndarray  # index into LEVELS, -1 where not valued
+    curves: pd.DataFrame
+
+    def rankings(self, frame, positions=None, n=15, include_outliers=False, fit="model"):
+        """Best deals among ``positions`` (all rows by default), highest ``DealScore`` first.
+
+        Only listings valued with a curve at least as specific as ``fit``
+        are ranked, and an ad repeated in the data is listed once.
+        """
+        positions = np.arange(len(frame)) if positions is None else np.asarray(positions)
+        level = self.level[positions]
+        keep = (level >= 0) & (level <= LEVELS.index(fit))
+        if not include_outliers:
+            keep &= ~self.outlier[positions]
+        positions = positions[keep]
+        order = np.argsort(-self.deal_score[positions], kind="stable")
+        candidates = positions[order[:n * 3]]
+        table = self._table(frame, candidates)
+        table = table[~pd.Series(fingerprint(table)).duplicated().to_numpy()].head(n).reset_index(drop=True)
+        table["Percentile"] = (table.pop("_percentile") * 100).round(0)
+        return table
+
+    def _table(self, frame, positions):
+        table = frame[[c for c in RANKING_COLUMNS[:6] if c in frame.columns]].take(positions).reset_index(drop=True)
+        table["Expected"] = self.expected[positions].round(-2)
+        table["DealScore"] = self.deal_score[positions].round(1)
+        table["_percentile"] = self.percentile[positions]
+        return table
+
+    def outliers(self, frame, positions=None):
+        positions = np.arange(len(frame)) if positions is None else np.asarray(positions)
+        return self._table(frame, positions[self.outlier[positions]]).drop(columns="_percentile")
+
+    def curves_for(self, frame, positions=None, n=20):
+        """Depreciation curves of the models present in ``positions``, most listed first."""
+        if positions is None:
+            return self.curves.head(n)
+        present = frame[["Brand", "Model"]].take(np.asarray(positions)).drop_duplicates()
+        curves = self.curves.merge(present.astype(str), on=["Brand", "Model"])
+        return curves.head(n)
+
+
+def build_valuation(frame):
+    """Fit every model's curve on ``frame`` and score each of its listings."""
+    with span("valuation", rows_in=len(frame)) as s:
+        valuation = _build(frame)
+        s.rows_out = int((~np.isnan(valuation.deal_score)).sum())
+        s.attrs["models_fitted"] = int((valuation.curves["Fit"] == "model").sum())
+    return valuation
+
+
+def _build(frame):
+    n = len(frame)
+    expected = np.full(n, np.nan)
+    residual_all = np.full(n, np.nan)
+    level_all = np.full(n, -1, dtype=np.int8)
+    positions, age, log_km, log_price = _design(frame)
+    if not len(positions):
+        empty = np.full(n, np.nan)
+        return Valuation(expected, empty, empty.copy(), np.zeros(n, dtype=bool), level_all,
+                         pd.DataFrame(columns=CURVE_COLUMNS))
+
+    brand = frame["Brand"].take(positions).astype(str).to_numpy()
+    model = frame["Model"].take(positions).astype(str).to_numpy()
+    model_codes, model_keys = pd.factorize(pd.MultiIndex.from_arrays([brand, model]))
+    brand_codes, brand_keys = pd.factorize(brand)
+    market_codes = np.zeros(len(positions), dtype=np.intp)
+
+    fits = []
+    for codes, size in ((model_codes, len(model_keys)), (brand_codes, len(brand_keys)), (market_codes, 1)):
+        fits.append((codes,) + fit_groups(codes, size, age, log_km, log_price))
+
+    # Most specific usable level per row; the market fit is always used as a last resort.
+    coef = np.empty((len(positions), 3))
+    level = np.full(len(positions), len(LEVELS) - 1, dtype=np.int8)
+    chosen = np.zeros(len(positions), dtype=bool)
+    for i, (codes, group_coef, _, usable) in enumerate(fits):
+        take = ~chosen & (usable[codes] if i < len(LEVELS) - 1 else True)
+        coef[take] = group_coef[codes[take]]
+        level[take] = i
+        chosen |= take
+
+    predicted = coef[:, 0] + coef[:, 1] * age + coef[:, 2] * log_km
+    residual = log_price - predicted
+    expected[positions] = np.exp(predicted)
+    residual_all[positions] = residual
+    level_all[positions] = level
+
+    # Percentile and robust spread within each model (higher percentile = better deal).
+    by_model = pd.Series(-residual).groupby(model_codes)
+    percentile = np.full(n, np.nan)
+    percentile[positions] = by_model.rank(pct=True).to_numpy()
+    centre = by_model.transform("median").to_numpy()
+    mad = pd.Series(np.abs(-residual - centre)).groupby(model_codes).transform("median").to_numpy()
+    spread = np.maximum(1.4826 * mad, 0.05)  # at least ~5% so identical prices are not all outliers
+    outlier = np.zeros(n, dtype=bool)
+    outlier[positions] = np.abs(-residual - centre) / spread > OUTLIER_Z
+
+    deal_score = (1.0 - np.exp(residual_all)) * 100.0
+    curves = _curves(model_keys, fits, log_price, model_codes)
+    return Valuation(expected, deal_score, percentile, outlier, level_all, curves)
+
+
+def _curves(model_keys, fits, log_price, model_codes):
+    (_, model_coef, counts, usable), (brand_codes, brand_coef, _, brand_usable), (_, market_coef, _, _) = fits
+    # Each model's brand, via any one of its rows.
+    first_row = np.full(len(model_keys), -1)
+    first_row[model_codes[::-1]] = np.arange(len(model_codes))[::-1]
+    model_brand = brand_codes[first_row]
+    use_brand = ~usable & brand_usable[model_brand]
+    coef = np.where(usable[:, None], model_coef,
+                    np.where(use_brand[:, None], brand_coef[model_brand], market_coef[0]))
+    fit = np.where(usable, "model", np.where(use_brand, "brand", "market"))
+    typical = np.exp(np.bincount(model_codes, weights=log_price, minlength=len(model_keys)) / np.maximum(counts, 1))
+    curves = pd.DataFrame({
+        "Brand": model_keys.get_level_values(0),
+        "Model": model_keys.get_level_values(1),
+        "Listings": counts.astype(int),
+        "Fit": fit,
+        # Price lost per extra year of age, and per 10,000 km added at REFERENCE_KM.
+        "Annual Depreciation %": ((1 - np.exp(coef[:, 1])) * 100).round(1),
+        "Per 10k km %": ((1 - np.exp(coef[:, 2] * np.log((REFERENCE_KM + 10001) / (REFERENCE_KM + 1)))) * 100).round(1),
+        "Typical Price": typical.round(-2),
+    })
+    return curves.sort_values("Listings", ascending=False, kind="stable").reset_index(drop=True)
+
+
+@per_frame_cache
+def get_valuation(frame):
+    """Return the valuation of ``frame``, building it on first use and caching it per frame object."""
+    return build_valuation(frame)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def market_frame():
+    """600 normalized Toyota/Nissan listings priced by a known depreciation curve (8%/year)."""
+    rng = np.random.default_rng(0)
+    n = 600
+    model = rng.choice(["Camry", "Corolla", "Patrol"], n)
+    base = pd.Series(model).map({"Camry": 11.4, "Corolla": 11.0, "Patrol": 12.3}).to_numpy()
+    year = rng.integers(2012, 2025, n)
+    km = rng.integers(5000, 250000, n).astype("float64")
+    log_price = base - 0.08 * (2024 - year) - 0.05 * np.log1p(km) + rng.normal(0, 0.05, n)
+    return pd.DataFrame({
+        "Brand": pd.Categorical(np.where(model == "Patrol", "Nissan", "Toyota")),
+        "Model": pd.Categorical(model),
+        "Price": np.exp(log_price).round(-2),
+        "Year": pd.array(year, dtype="Int16"),
+        "Kilometers": km,
+    })
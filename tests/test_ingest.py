@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pandas as pd
+
+import market.ingest as ingest
+from market.ingest import FrameCache, frame_nbytes
+
+
+def _frame(n=100):
+    return pd.DataFrame({"Price": range(n)})
+
+
+def test_acquire_loads_once_and_shares_the_frame():
+    cache = FrameCache()
+    first = cache.acquire("a", _frame)
+    second = cache.acquire("a", lambda: 1 / 0)
+    assert (first.hit, second.hit) == (False, True)
+    assert first.frame is second.frame
+    assert cache.stats()["leases"] == 2
+
+
+def test_concurrent_acquires_load_once(monkeypatch):
+    # A slow size computation used to leave a window in which a new
+    # caller missed the entry and parsed the data again.
+    def slow_nbytes(df):
+        time.sleep(0.05)
+        return frame_nbytes(df)
+
+    monkeypatch.setattr(ingest, "frame_nbytes", slow_nbytes)
+    cache = FrameCache()
+    loads, leases = [], []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.05)
+        return _frame()
+
+    def worker(delay):
+        time.sleep(delay)
+        leases.append(cache.acquire("a", loader))
+
+    threads = [threading.Thread(target=worker, args=(i * 0.02,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1
+    assert len({id(lease.frame) for lease in leases}) == 1
+    assert cache.stats()["bytes"] == frame_nbytes(leases[0].frame)
+
+
+def test_failed_load_can_be_retried():
+    cache = FrameCache()
+    try:
+        cache.acquire("a", lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert not cache.acquire("a", _frame).hit
+
+
+def test_leased_frames_are_not_evicted():
+    cache = FrameCache(max_entries=2)
+    held = cache.acquire("a", _frame)
+    for key in "bcd":
+        cache.acquire(key, _frame).release()
+    assert cache.get("a") is held.frame
+    assert cache.stats()["entries"] == 2
+
+    held.release()
+    for key in "ef":
+        cache.acquire(key, _frame).release()
+    assert cache.get("a") is None
+
+
+def test_lease_is_released_when_collected():
+    cache = FrameCache(max_entries=1)
+    lease = cache.acquire("a", _frame)
+    assert cache.stats()["pinned"] == 1
+    del lease
+    assert cache.stats()["pinned"] == 0
+
+
+def test_clear_keeps_leased_frames():
+    cache = FrameCache()
+    held = cache.acquire("a", _frame)
+    cache.acquire("b", _frame).release()
+    cache.clear()
+    assert cache.get("a") is held.frame
+    assert cache.get("b") is None
+    assert cache.stats()["bytes"] == frame_nbytes(held.frame)
+
+
+def test_release_while_the_cache_is_locked():
+    # Lease finalizers can run from cyclic GC inside another cache call on
+    # the same thread; releasing must not wait for the cache's lock.
+    cache = FrameCache()
+    lease = cache.acquire("a", _frame)
+    released = threading.Event()
+
+    def release_under_lock():
+        with cache._lock:
+            lease.release()
+        released.set()
+
+    threading.Thread(target=release_under_lock, daemon=True).start()
+    assert released.wait(5)
+    assert cache.stats()["pinned"] == 0
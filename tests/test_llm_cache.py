@@ -0,0 +1,28 @@
+import pytest
+
+from market.analysis import run_analysis
+from market.llm_cache import ResponseCache
+
+
+def _key(question, frame):
+    return run_analysis(question, frame, None, []).response_key()
+
+
+def test_same_question_same_data_shares_a_key(market_frame):
+    assert _key("overall market trend", market_frame) == _key("overall market trend", market_frame)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("overall market trend", "Which brands in the market hold their value best for resale?"),
+    ("overall market trend", "市场上最便宜的品牌是哪个？"),
+    ("condition: Toyota under 90000, which is most reliable?", "condition: Toyota under 90000, cheapest to insure?"),
+])
+def test_different_questions_miss_the_cache(market_frame, first, second):
+    cache = ResponseCache(":memory:")
+    cache.put(_key(first, market_frame), "answer to the first question")
+    assert cache.get(_key(second, market_frame)) is None
+    assert cache.get(_key(first, market_frame)) == "answer to the first question"
+
+
+def test_different_data_misses_the_cache(market_frame):
+    assert _key("overall market trend", market_frame) != _key("overall market trend", market_frame.head(300))
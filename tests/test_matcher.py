@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from market.matcher import BrandModelIndex
+
+
+@pytest.fixture(scope="module")
+def index():
+    return BrandModelIndex(pd.DataFrame({
+        "Brand": ["Smart", "MINI", "RAM", "Genesis", "Toyota", "Toyota", "Mazda", "Mercedes-Benz"],
+        "Model": ["ForTwo", "Cooper", "1500", "G80", "Land Cruiser", "RAV4", "6", "G-Class"],
+    }))
+
+
+@pytest.mark.parametrize("question, brands, models", [
+    ("condition: a smart family car under 60000", (), ()),
+    ("the genesis of this market", (), ()),
+    ("ram prices", (), ()),
+    ("Smart ForTwo under 40000", ("Smart",), (("Smart", "ForTwo"),)),
+    ("MINI prices", ("MINI",), ()),
+    ("mini cooper 2020", ("MINI",), (("MINI", "Cooper"),)),
+    ("ram 1500", ("RAM",), (("RAM", "1500"),)),
+    ("toyota land cruiser or rav4", ("Toyota",), (("Toyota", "Land Cruiser"), ("Toyota", "RAV4"))),
+    ("merc g-class", ("Mercedes-Benz",), (("Mercedes-Benz", "G-Class"),)),
+    ("mazda 6 with 6 seats", ("Mazda",), (("Mazda", "6"),)),
+])
+def test_resolve(index, question, brands, models):
+    mentions = index.resolve(question)
+    assert (mentions.brands, mentions.models) == (brands, models)
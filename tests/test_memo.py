@@ -0,0 +1,35 @@
+import gc
+import weakref
+
+import pandas as pd
+
+from market.memo import per_frame_cache
+
+
+def test_builds_once_per_frame_object():
+    calls = []
+
+    @per_frame_cache
+    def build(frame):
+        calls.append(1)
+        return object()
+
+    frame = pd.DataFrame({"Price": [1.0, 2.0]})
+    assert build(frame) is build(frame)
+    assert build(frame.copy()) is not build(frame)
+    assert len(calls) == 2
+
+
+def test_entry_is_dropped_with_its_frame():
+    class Built:
+        pass
+
+    build = per_frame_cache(lambda frame: Built())
+    frame = pd.DataFrame({"Price": [1.0]})
+    value = weakref.ref(build(frame))
+    assert value() is not None
+    del frame
+    gc.collect()
+    build(pd.DataFrame({"Price": [2.0]}))  # dropped entries are removed on the next call
+    assert value() is None
+
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from market.matcher import BrandModelIndex
+from market.planner import (
+    BRAND_MARKET, CONDITION, HISTORY_LINE, OVERALL, parse_question, plan_question, select_rows,
+)
+
+
+@pytest.mark.parametrize("question, expected", [
+    # The question box placeholder.
+    ("condition: under 120000km, BMW or Lexus, below 90k AED",
+     dict(mode=CONDITION, price_min=None, price_max=90000, km_max=120000)),
+    ("condition: under 120,000 km, BMW or Lexus, below 90000",
+     dict(mode=CONDITION, price_min=None, price_max=90000, km_max=120000)),
+    ("condition: Toyota between 50000 and 90000", dict(price_min=50000, price_max=90000)),
+    ("condition: Nissan 50k-90k", dict(price_min=50000, price_max=90000)),
+    ("condition: Lexus 40000", dict(price_min=40000, price_max=None)),
+    # Mileage and year- figures are not also the price.
+    ("condition: 150,000 km under 60000 year-2019",
+     dict(price_min=None, price_max=60000, km_max=150000, years=(2019,))),
+    ("condition: BMW year-2021, 2020", dict(price_min=None, price_max=None, years=(2020, 2021))),
+    # A bare model year is not a price; comma-grouped amounts are.
+    ("condition: BMW 2019 under 90000", dict(price_min=None, price_max=90000)),
+    ("condition: BMW X5 2020 model under 150k", dict(price_min=None, price_max=150000)),
+    ("condition: Toyota 2018-2020 under 90000", dict(price_min=None, price_max=90000)),
+    ("condition: Camry 2021", dict(price_min=None, price_max=None)),
+    ("condition: below 90,000 AED", dict(price_min=None, price_max=90000)),
+    ("condition: from 50,000 to 90,000", dict(price_min=50000, price_max=90000)),
+    ("condition: over 50000 under 90,000", dict(price_min=50000, price_max=90000)),
+])
+def test_condition_bounds(question, expected):
+    plan = parse_question(question)
+    for field, value in expected.items():
+        assert getattr(plan, field) == value, field
+
+
+@pytest.mark.parametrize("question, mode, brand, model", [
+    ('history line brand-"Tesla" model-"Model Y"', HISTORY_LINE, "Tesla", "Model Y"),
+    ("history line brand-'Toyota' model-'Land Cruiser' year-2022", HISTORY_LINE, "Toyota", "Land Cruiser"),
+    ('brand market brand-"Toyota"', BRAND_MARKET, "Toyota", None),
+    ("overall market trend", OVERALL, None, None),
+    ("整体市场怎么样", OVERALL, None, None),
+    ("what should I buy?", None, None, None),
+])
+def test_mode_and_explicit_names(question, mode, brand, model):
+    plan = parse_question(question)
+    assert (plan.mode, plan.brand, plan.model) == (mode, brand, model)
+
+
+def test_history_line_has_no_price_bounds():
+    plan = parse_question('history line brand-"BMW" model-"X5" under 90000')
+    assert plan.price_min is None and plan.price_max is None
+
+
+def test_plan_resolves_mentions_and_selects_rows():
+    frame = pd.DataFrame({
+        "Brand": pd.Categorical(["BMW", "BMW", "Lexus", "Toyota", "Lexus"]),
+        "Model": pd.Categorical(["X5", "X5", "RX", "Camry", "LX"]),
+        "Price": [85000.0, 120000.0, 70000.0, 60000.0, 95000.0],
+        "Year": pd.array([2019, 2021, 2020, 2020, 2022], dtype="Int16"),
+        "Kilometers": [90000.0, 40000.0, 130000.0, 50000.0, 60000.0],
+    })
+    index = BrandModelIndex(frame)
+    plan = plan_question("condition: under 120000km, BMW or Lexus, below 90k AED", index)
+    assert plan.mentions.brands == ("BMW", "Lexus")
+    assert list(select_rows(frame, plan, index)) == [0]
+
+
+@pytest.mark.parametrize("question, rankings_only", [
+    ("top deals for Toyota under 50000", True),
+    ("best 5 deals on Nissan", True),
+    ("condition: Lexus rankings", True),
+    ("rank the listings for BMW", True),
+    ("丰田排名", True),
+    ("condition: Frank needs a BMW under 90000", False),
+    ("condition: cranky old Toyota under 50000", False),
+    ("how do brands rank on resale?", False),
+    ('history line brand-"Toyota" model-"Camry" top deals', False),
+])
+def test_rankings_only(question, rankings_only):
+    assert parse_question(question).rankings_only is rankings_only
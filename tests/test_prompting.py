@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from market.prompting import (
+    LEVEL_AGGREGATES, LEVEL_FULL, LEVEL_QUANTILES, LEVEL_SAMPLE, count_tokens, fit_table, stratified_sample,
+)
+
+
+def _listings(n, brands=4, models=3, seed=0):
+    rng = np.random.default_rng(seed)
+    brand = rng.integers(0, brands, n)
+    return pd.DataFrame({
+        "Brand": [f"Brand{b}" for b in brand],
+        "Model": [f"Model{b}-{m}" for b, m in zip(brand, rng.integers(0, models, n))],
+        "Price": rng.integers(20000, 400000, n).astype("float64"),
+        "Year": rng.integers(2010, 2025, n),
+        "Kilometers": rng.integers(0, 250000, n).astype("float64"),
+    })
+
+
+def test_small_table_is_sent_in_full():
+    df = _listings(20)
+    table = fit_table(df, budget=2000)
+    assert table.level == LEVEL_FULL
+    assert table.rows_out == 20
+    assert table.tokens == count_tokens(table.text) <= 2000
+
+
+def test_large_table_falls_back_to_aggregates():
+    df = _listings(5000)
+    table = fit_table(df, budget=2000)
+    assert table.level.startswith(LEVEL_AGGREGATES)
+    assert table.rows_out == df.groupby(["Brand", "Model"]).ngroups
+    assert table.tokens <= 2000
+
+
+def test_many_groups_fall_back_to_a_sample():
+    df = _listings(5000, brands=40, models=30)
+    table = fit_table(df, budget=3000)
+    assert table.level == LEVEL_SAMPLE
+    assert table.tokens <= 3000
+
+
+def test_tiny_budget_ends_in_quantiles():
+    table = fit_table(_listings(5000, brands=40, models=30), budget=50)
+    assert table.level.startswith(LEVEL_QUANTILES)
+
+
+@pytest.mark.parametrize("n", [10, 300])
+def test_stratified_sample_keeps_every_group(n):
+    df = _listings(2000, brands=5, models=4)
+    sample = stratified_sample(df, ["Brand", "Model"], n)
+    assert set(sample["Model"]) == set(df["Model"])
+    assert len(sample) <= n + df["Model"].nunique()  # at least one row per group
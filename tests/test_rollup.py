@@ -0,0 +1,67 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from market.rollup import RELATIVE_ACCURACY, TrendRollup, bucket_of, bucket_value, sketch_quantiles, summarize
+from market.store import SnapshotStore
+
+
+def _snapshot(day, n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Brand": pd.Categorical(rng.choice(["Toyota", "Nissan"], n)),
+        "Model": pd.Categorical(rng.choice(["A", "B", "C"], n)),
+        "Year": pd.array(rng.integers(2015, 2025, n), dtype="Int16"),
+        "Price": np.exp(rng.normal(11.5, 0.6, n)).round(-2),
+        "Kilometers": rng.integers(0, 200000, n).astype("float64"),
+        "Date": pd.Timestamp(day),
+    })
+
+
+def test_buckets_round_trip_within_accuracy():
+    values = np.array([1.0, 950.0, 48500.0, 1250000.0])
+    assert np.all(np.abs(bucket_value(bucket_of(values)) / values - 1) <= RELATIVE_ACCURACY)
+    assert bucket_value(bucket_of([0.0]))[0] == 0.0
+
+
+@pytest.mark.parametrize("q", [0.1, 0.5, 0.9])
+def test_sketch_quantiles_match_exact_quantiles(q):
+    frame = _snapshot("2025-04-15", 2001, seed=1)
+    _, sketch = summarize(frame)
+    result = sketch_quantiles(sketch[sketch["Metric"] == "Price"], ["Brand"], (q,))
+    exact = frame.groupby("Brand", observed=True)["Price"].quantile(q)
+    for brand, value in zip(result["Brand"], result[f"q{int(q * 100)}"]):
+        assert value == pytest.approx(exact[brand], rel=RELATIVE_ACCURACY)
+
+
+def test_trend_merges_snapshots(tmp_path):
+    rollup = TrendRollup(str(tmp_path))
+    frames = [_snapshot("2025-04-15", 500, seed=2), _snapshot("2025-04-16", 700, seed=3)]
+    for i, frame in enumerate(frames):
+        assert rollup.add_snapshot(frame, f"digest{i}")
+    assert not rollup.add_snapshot(frames[0], "digest0")
+
+    trend = rollup.trend()
+    assert list(trend["Count"]) == [500, 700]
+    for frame, (_, row) in zip(frames, trend.iterrows()):
+        assert row["MedianPrice"] == pytest.approx(frame["Price"].median(), rel=RELATIVE_ACCURACY)
+        assert row["Kilometers"] == pytest.approx(frame["Kilometers"].mean())
+        assert row["Year"] == pytest.approx(frame["Year"].astype("float64").mean())
+
+
+def test_store_backfills_the_rollup_once(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    for i, day in enumerate(["2025-04-15", "2025-04-16"]):
+        store.append(_snapshot(day, 300, seed=i), f"digest{i}")
+    shutil.rmtree(store.rollup.root)  # as if stored before the rollup existed
+
+    fresh = SnapshotStore(str(tmp_path))
+    assert fresh.ensure_rollup() == 2
+    assert list(fresh.rollup.trend()["Count"]) == [300, 300]
+
+    listed = []
+    fresh.sources = lambda: listed.append(1) or []
+    assert fresh.ensure_rollup() == 0
+    assert not listed
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from market.analysis import run_analysis
+from market.valuation import build_valuation
+
+
+def test_curves_recover_the_depreciation_rate(market_frame):
+    valuation = build_valuation(market_frame)
+    curves = valuation.curves.set_index("Model")
+    assert (curves["Fit"] == "model").all()
+    assert curves["Annual Depreciation %"].to_numpy() == pytest.approx((1 - np.exp(-0.08)) * 100, abs=1.0)
+
+
+def test_mispriced_listing_is_an_outlier_not_a_deal(market_frame):
+    frame = market_frame
+    frame.loc[0, "Price"] = frame.loc[0, "Price"] / 20  # e.g. a monthly payment
+    valuation = build_valuation(frame)
+    assert valuation.outlier[0]
+    deals = valuation.rankings(frame, n=5)
+    assert len(deals) == 5
+    assert deals["DealScore"].is_monotonic_decreasing
+
+
+@pytest.mark.parametrize("question", [
+    "overall market", "condition: Toyota under 90000", 'brand market brand-"Nissan"', "top deals for Toyota",
+])
+def test_rankings_without_a_title_column(market_frame, question):
+    analysis = run_analysis(question, market_frame, None, [])
+    assert len(analysis.tables["deals"]) > 0
+    assert "Title" not in analysis.tables["deals"].columns